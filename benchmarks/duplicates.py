@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Near-duplicate search on news-like texts against the pairwise scan"""
+import argparse
+import random
+import time
+
+from digest.feed import FeedEntrie, find_duplicates
+
+STARTERS = ("The", "A", "In", "This", "It", "On", "As", "After", "According", "Shares")
+WORDS = ("company", "reported", "trial", "results", "patients", "dose", "approval", "deal",
+         "funding", "round", "data", "study", "cells", "therapy", "market", "investors")
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.duplicates")
+    parser.add_argument('--entries', type=int, nargs='+', default=[1000, 5000],
+                        dest='entries', help="numbers of entries to compare on")
+    parser.add_argument('--names', type=int, default=3000,
+                        dest='names', help="number of distinct company and drug names")
+    parser.add_argument('--duplicate-rate', type=float, default=0.05,
+                        dest='duplicate_rate', help="share of entries rewriting an earlier one")
+    parser.add_argument('--seed', type=int, default=42,
+                        dest='seed', help="random seed")
+    return parser.parse_args()
+
+def make_entries(size: int, names: int, duplicate_rate: float) -> list[FeedEntrie]:
+    """News-like entries: sentences start with common capitalized words and mention
+    a few names with Zipf-like popularity, some entries reword earlier ones"""
+    vocabulary = [f"Name{i}" for i in range(names)]
+    weights = [1 / (rank + 1) for rank in range(names)]
+    contents = []
+    for _ in range(size):
+        if contents and random.random() < duplicate_rate:
+            words = random.choice(contents).split()
+            words[random.randrange(len(words))] = random.choice(WORDS)
+            contents.append(" ".join(words))
+            continue
+        sentences = []
+        for _ in range(random.randint(2, 5)):
+            sentence = [random.choice(STARTERS)] + random.choices(WORDS, k=12)
+            for name in random.choices(vocabulary, weights, k=random.randint(1, 3)):
+                sentence.insert(random.randrange(1, len(sentence)), name)
+            sentences.append(" ".join(sentence) + ".")
+        contents.append(" ".join(sentences))
+    return [FeedEntrie(f"Entry {i}", content, None, f"https://example.com/{i}")
+            for i, content in enumerate(contents)]
+
+def pairwise_duplicates(entries, threshold: float = 0.8):
+    """Original scan over all pairs"""
+    capitals = set(chr(i) for i in range(ord('A'), ord('Z') + 1))
+    keywords = [set(word for word in entrie.content.split() if word[0] in capitals)
+                for entrie in entries]
+    duplicates = {}
+    for j in range(len(entries)):
+        for i in range(j):
+            least = min(len(keywords[i]), len(keywords[j]))
+            if len(keywords[i] & keywords[j]) >= threshold * least:
+                duplicates[j] = i
+                break
+    return duplicates
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    random.seed(args.seed)
+    print(f"{'entries':>8} {'duplicates':>10} {'pairwise':>9} {'prefix':>9} {'speedup':>8}")
+    for size in args.entries:
+        entries = make_entries(size, args.names, args.duplicate_rate)
+        start = time.perf_counter()
+        expected = pairwise_duplicates(entries)
+        pairwise = time.perf_counter() - start
+        start = time.perf_counter()
+        found = find_duplicates(entries)
+        indexed = time.perf_counter() - start
+        assert found == expected
+        print(f"{size:>8} {len(found):>10} {pairwise:>8.2f}s {indexed:>8.2f}s "
+              f"{pairwise / indexed:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Memory kept by parsed feeds: whole feedparser results against compact entries"""
+import argparse
+import gc
+import os
+import pickle
+import random
+import tempfile
+import time
+import tracemalloc
+
+import feedparser
+
+from benchmarks.pipeline import make_feeds
+from digest.feed import parse_feed
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.entries")
+    parser.add_argument('--entries', type=int, default=20000,
+                        dest='entries', help="number of synthetic feed entries")
+    parser.add_argument('--entries-per-feed', type=int, default=50,
+                        dest='entries_per_feed', help="entries in every synthetic feed")
+    return parser.parse_args()
+
+def measure(parse, texts: dict[str, str]) -> tuple[float, int, int, int]:
+    """Parses all feeds keeping the results like FeedLoader.feeds does"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    feeds = {name: parse(text, name) for name, text in texts.items()}
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cached = sum(len(pickle.dumps(feed)) for feed in feeds.values())
+    return elapsed, retained, peak, cached
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    random.seed(42)
+    keywords = [f"Keyword{i}" for i in range(200)]
+    with tempfile.TemporaryDirectory() as root:
+        names = make_feeds(root, args.entries, args.entries_per_feed, 0.02, keywords)
+        texts = {}
+        for name in names:
+            with open(os.path.join(root, name), "r", encoding="utf8") as file:
+                texts[name] = file.read()
+    print(f"{args.entries} entries in {len(texts)} feeds, "
+          f"{sum(map(len, texts.values())) / 2 ** 20:.1f}MB of XML")
+    print(f"{'kept':>10} {'time':>8} {'retained':>10} {'peak':>10} {'cache':>10}")
+    for name, parse in (('feedparser', lambda text, _: feedparser.parse(text)),
+                        ('compact', parse_feed)):
+        elapsed, retained, peak, cached = measure(parse, texts)
+        print(f"{name:>10} {elapsed:>7.2f}s {retained / 2 ** 20:>8.1f}MB "
+              f"{peak / 2 ** 20:>8.1f}MB {cached / 2 ** 20:>8.1f}MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local OpenAI-compatible chat completions server for offline benchmarks"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PORT = 8765
+
+class FakeOpenAI(ThreadingHTTPServer):
+    """Answers chat completions with canned content after a simulated delay"""
+    daemon_threads = True
+
+    def __init__(self, port: int = PORT, latency: float = 0.5, token_latency: float = 0.0,
+                 rate_limit: float = 0.0, requests_per_minute: int = 0,
+                 limited_models: list[str] = (), model_latency: dict[str, float] = None,
+                 inline: bool = False):
+        super().__init__(('127.0.0.1', port), FakeOpenAIHandler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.rate_limit = rate_limit
+        self.requests_per_minute = requests_per_minute
+        self.limited_models = set(limited_models)
+        self.model_latency = model_latency or {}
+        self.inline = inline
+        self.history = []
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                      'models': {}}
+
+    @property
+    def api_base(self) -> str:
+        """Base URL to pass to openai.api_base"""
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        """Serves requests in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def limited(self, model: str) -> bool:
+        """Decides whether the request should get 429 response, limited models always get it"""
+        with self.lock:
+            if model in self.limited_models:
+                self.stats['rate_limited'] += 1
+                return True
+            now = time.monotonic()
+            self.history = [moment for moment in self.history if now - moment < 60]
+            if self.requests_per_minute and len(self.history) >= self.requests_per_minute:
+                self.stats['rate_limited'] += 1
+                return True
+            if random.random() < self.rate_limit:
+                self.stats['rate_limited'] += 1
+                return True
+            self.history.append(now)
+            return False
+
+    def account(self, model: str, prompt_tokens: int, completion_tokens: int):
+        """Accumulates served requests and tokens"""
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['models'][model] = self.stats['models'].get(model, 0) + 1
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Handles /v1/chat/completions"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, content):
+        data = json.dumps(content).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.server.limited(body['model']):
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                            'param': None, 'code': None}})
+            return
+        system_prompt = body['messages'][0]['content']
+        user_prompt = body['messages'][-1]['content']
+        content = answer(system_prompt, user_prompt, self.server.inline)
+        prompt_tokens = len(system_prompt.split()) + len(user_prompt.split())
+        completion_tokens = len(content.split())
+        time.sleep(self.server.model_latency.get(body['model'], self.server.latency) +
+                   self.server.token_latency * completion_tokens)
+        self.server.account(body['model'], prompt_tokens, completion_tokens)
+        self._send_json(200, {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens}})
+
+def answer(system_prompt: str, user_prompt: str, inline: bool = False) -> str:
+    """Makes a plausible answer for the digest prompts, numbered messages are answered
+    with every number on its own line or inline before the summary"""
+    paragraphs = [paragraph.strip() for paragraph in
+                  re.split(r'^\d+$', user_prompt, flags=re.MULTILINE)[1:]]
+    if system_prompt.startswith('Cluster'):
+        ids = list(range(1, len(paragraphs) + 1))
+        return json.dumps({f"Topic #{i // 5 + 1}": ids[i:i + 5] for i in range(0, len(ids), 5)})
+    if system_prompt.startswith('Name the topic') and paragraphs:
+        return shorten(paragraphs[0], 6)
+    if 'numbered messages' in system_prompt and paragraphs:
+        separator = ". " if inline else "\n"
+        return ("\n" if inline else "\n\n").join(f"{idx}{separator}{shorten(paragraph)}"
+                                                for idx, paragraph in enumerate(paragraphs, start=1))
+    if system_prompt.startswith('Write short hightlights'):
+        return "\n".join(f"{idx}. {shorten(line)}"
+                         for idx, line in enumerate(user_prompt.splitlines()[:10], start=1))
+    if system_prompt.startswith('You translate') or system_prompt.startswith('You will be given a report'):
+        return user_prompt
+    return shorten(user_prompt)
+
+def shorten(text: str, words: int = 30) -> str:
+    """Keeps first words of the text"""
+    return " ".join(text.split()[:words])
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.fake_openai")
+    parser.add_argument('--port', type=int, default=PORT,
+                        dest='port', help="port to listen")
+    parser.add_argument('--latency', type=float, default=0.5,
+                        dest='latency', help="delay of every response, seconds")
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        dest='token_latency', help="extra delay per completion token, seconds")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        dest='rate_limit', help="probability of 429 response")
+    parser.add_argument('--rpm', type=int, default=0,
+                        dest='rpm', help="requests per minute before 429 responses")
+    parser.add_argument('--limited-models', nargs='*', default=[], metavar='MODEL',
+                        dest='limited_models', help="models always answering with 429")
+    parser.add_argument('--model-latency', nargs=2, action='append', default=[],
+                        metavar=('MODEL', 'SECONDS'),
+                        dest='model_latency', help="response delay of the model, may be repeated")
+    parser.add_argument('--inline', action='store_true',
+                        dest='inline', help="answer numbered messages as \"1. summary\" lines")
+    return parser.parse_args()
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    server = FakeOpenAI(args.port, args.latency, args.token_latency, args.rate_limit, args.rpm,
+                        args.limited_models, {model: float(seconds)
+                                              for model, seconds in args.model_latency},
+                        args.inline)
+    print("Serving on", server.api_base)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local Telegram Bot API server for offline delivery tests"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+PORT = 8766
+MESSAGE_LIMIT = 4096
+
+class FakeTelegram(ThreadingHTTPServer):
+    """Accepts sendMessage requests, enforces message size and per chat rate limits"""
+    daemon_threads = True
+
+    def __init__(self, port: int = PORT, latency: float = 0.05, chat_interval: float = 0.0,
+                 rate_limit: float = 0.0, retry_after: int = 1):
+        super().__init__(('127.0.0.1', port), FakeTelegramHandler)
+        self.latency = latency
+        self.chat_interval = chat_interval
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.last_messages = {}
+        self.messages = []
+        self.stats = {'requests': 0, 'rate_limited': 0, 'rejected': 0, 'sent': 0}
+
+    @property
+    def api_url(self) -> str:
+        """Base URL to pass as TELEGRAM_API_URL"""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """Serves requests in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def send(self, chat_id: str, text: str) -> tuple[int, dict]:
+        """Records the message or tells why it was not accepted"""
+        with self.lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            if now - self.last_messages.get(chat_id, -self.chat_interval) < self.chat_interval or \
+                    random.random() < self.rate_limit:
+                self.stats['rate_limited'] += 1
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f"Too Many Requests: retry after {self.retry_after}",
+                             'parameters': {'retry_after': self.retry_after}}
+            if not text or len(text) > MESSAGE_LIMIT:
+                self.stats['rejected'] += 1
+                return 400, {'ok': False, 'error_code': 400,
+                             'description': "Bad Request: message is too long"}
+            self.last_messages[chat_id] = now
+            self.stats['sent'] += 1
+            self.messages.append((chat_id, text))
+            return 200, {'ok': True, 'result': {'message_id': len(self.messages),
+                                                'chat': {'id': chat_id}, 'text': text}}
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """Handles /bot<token>/sendMessage"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = {key: values[0] for key, values in
+                  parse_qs(self.rfile.read(length).decode('utf8')).items()}
+        time.sleep(self.server.latency)
+        if self.path.endswith('/sendMessage'):
+            status, content = self.server.send(params.get('chat_id'), params.get('text'))
+        else:
+            status, content = 404, {'ok': False, 'error_code': 404, 'description': "Not Found"}
+        data = json.dumps(content).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.fake_telegram")
+    parser.add_argument('--port', type=int, default=PORT,
+                        dest='port', help="port to listen")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        dest='latency', help="delay of every response, seconds")
+    parser.add_argument('--chat-interval', type=float, default=0.0,
+                        dest='chat_interval', help="minimal seconds between messages of a chat")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        dest='rate_limit', help="probability of 429 response")
+    return parser.parse_args()
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    server = FakeTelegram(args.port, args.latency, args.chat_interval, args.rate_limit)
+    print("Serving on", server.api_url)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
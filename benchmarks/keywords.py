@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares KeywordMatcher with per-regexp keyword filtering"""
+import argparse
+import random
+import re
+import string
+import time
+
+from digest.keywords import KeywordMatcher
+
+MATCHES = 2
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.keywords")
+    parser.add_argument('--entries', type=int, default=10000,
+                        dest='entries', help="number of synthetic entries")
+    parser.add_argument('--keywords', type=int, default=1000,
+                        dest='keywords', help="number of synthetic keywords")
+    parser.add_argument('--seed', type=int, default=42,
+                        dest='seed', help="random seed")
+    return parser.parse_args()
+
+def make_keywords(vocabulary: list[str], size: int) -> list[re.Pattern]:
+    """Generates a mix of literal and regexp keywords"""
+    templates = ['{}', '{}', '{}', '{}-?\\d+', '\\b{}\\b', '(?i){}', '{}s?', 'anti-{}|{}-targeting']
+    keywords = []
+    for i in range(size):
+        word = vocabulary[i % len(vocabulary)]
+        keywords.append(re.compile(templates[i % len(templates)].replace('{}', word)))
+    return keywords
+
+def make_entries(vocabulary: list[str], words: list[str], size: int) -> list[tuple[str, str]]:
+    """Generates titles and descriptions mixing plain words and keywords"""
+    def sentence(length):
+        return " ".join(random.choice(vocabulary) if random.random() < 0.02 else random.choice(words)
+                        for _ in range(length))
+    return [(sentence(12), sentence(150)) for _ in range(size)]
+
+def naive_count(regexps: list[re.Pattern], title: str, description: str) -> int:
+    """Original per-regexp implementation"""
+    return sum(1 for regexp in regexps if regexp.search(title) or regexp.search(description))
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    random.seed(args.seed)
+    vocabulary = [''.join(random.choices(string.ascii_uppercase, k=random.randint(2, 6)))
+                  for _ in range(args.keywords)]
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 10)))
+             for _ in range(5000)]
+    regexps = make_keywords(vocabulary, args.keywords)
+    entries = make_entries(vocabulary, words, args.entries)
+
+    start = time.perf_counter()
+    naive = [naive_count(regexps, title, description) for title, description in entries]
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(regexps)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = [matcher.count(title, description) for title, description in entries]
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    limited = [matcher.count(title, description, limit=MATCHES) >= MATCHES
+               for title, description in entries]
+    limited_time = time.perf_counter() - start
+
+    assert naive == exact, "Distinct match counts differ"
+    assert limited == [count >= MATCHES for count in naive], "Filter decisions differ"
+    print(f"{args.entries} entries, {args.keywords} keywords, "
+          f"{len(matcher.unindexed)} without a required literal")
+    print(f"per-regexp loop:          {naive_time:8.3f}s")
+    print(f"matcher build:            {build_time:8.3f}s")
+    print(f"matcher, exact count:     {exact_time:8.3f}s ({naive_time / exact_time:.1f}x)")
+    print(f"matcher, limit={MATCHES}:        {limited_time:8.3f}s ({naive_time / limited_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
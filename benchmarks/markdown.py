@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares single-pass MarkdownV2 conversion with the original word by word one"""
+import argparse
+import random
+import re
+import time
+
+from digest.telegram import convert_markdown
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.markdown")
+    parser.add_argument('--topics', type=int, default=200,
+                        dest='topics', help="number of topics in synthetic digest")
+    parser.add_argument('--entries', type=int, default=10,
+                        dest='entries', help="number of entries per topic")
+    parser.add_argument('--repeat', type=int, default=5,
+                        dest='repeat', help="number of conversions to time")
+    parser.add_argument('--seed', type=int, default=42,
+                        dest='seed', help="random seed")
+    return parser.parse_args()
+
+def make_digest(topics: int, entries: int) -> str:
+    """Generates a digest with highlights, headers, numbered entries and links"""
+    words = ["antibody", "(phase", "II)", "trial", "1.5-fold", "CAR-T", "cells", "+20%", "data!",
+             "FDA_approval", "#biotech", "{dose}", "=", "results.", "mRNA", "**key**", "in", "vivo"]
+    def sentence(length):
+        return " ".join(random.choice(words) for _ in range(length))
+    lines = ["# Biotech News Report", "", "Daily highlights:", ""]
+    lines += [f"{i}. {sentence(20)}" for i in range(1, 11)]
+    for topic in range(topics):
+        lines += ["", f"## Topic {topic}: {sentence(4)}", ""]
+        lines += [f"{i}. {sentence(40)} [link](https://example.com/news/{topic}_{i}?id={i}(a))"
+                  for i in range(1, entries + 1)]
+    return "\n".join(lines)
+
+def original_escape_md_characters(text):
+    """Original word by word escaping"""
+    md_chars = ['_', '*', '[', ']', '(', ')',
+                '~', '`', '>', '#', '+', '-',
+                '=', '|', '{', '}', '.', '!']
+    link_re = re.compile(r'\[([^\[]+)\]\(([^\)]+)\)')
+    result = []
+    words = text.split(' ')
+    for word in words:
+        if link_re.match(word):
+            result.append(word)
+            continue
+        escapeword = ''
+        for char in word:
+            if char in md_chars:
+                escapeword += '\\'
+            escapeword += char
+        result.append(escapeword)
+    return " ".join(result)
+
+def original_line_numbers_to_emoji(text):
+    """Original prefix by prefix list numbers replacement"""
+    numbers = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣',
+               '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟']
+    for i, emoji in enumerate(numbers, start=1):
+        pattern = f"{i}."
+        if text.startswith(pattern):
+            text = f"{emoji}{text[len(pattern):]}"
+    return text
+
+def original_convert_markdown(text):
+    """Original line by line conversion"""
+    lines = text.split("\n")
+    header = False
+
+    result = []
+    for line in lines:
+        if line.startswith("# "):
+            continue
+        if line.startswith("## "):
+            line = line[3:]
+            header = True
+        line = original_line_numbers_to_emoji(line)
+        line = original_escape_md_characters(line)
+        if header:
+            line = f"*{line}*"
+        header = False
+        result.append(line)
+    return "\n".join(result)
+
+def measure(function, text: str, repeat: int) -> float:
+    """Best time of the conversion"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(text)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    random.seed(args.seed)
+    print(f"{'size':>10} {'original':>10} {'single-pass':>12} {'speedup':>8}")
+    for scale in (1, 4, 16):
+        digest = make_digest(args.topics * scale // 16, args.entries)
+        original_time = measure(original_convert_markdown, digest, args.repeat)
+        new_time = measure(convert_markdown, digest, args.repeat)
+        print(f"{len(digest):>10} {original_time * 1000:>8.1f}ms {new_time * 1000:>10.1f}ms "
+              f"{original_time / new_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Scaling of feed parsing with the number of parser processes"""
+import argparse
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+
+from benchmarks.pipeline import WORDS
+from digest.feed import FeedParser, DOWNLOAD_WORKERS
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.parsing")
+    parser.add_argument('--feeds', type=int, default=2000,
+                        dest='feeds', help="number of synthetic feeds")
+    parser.add_argument('--entries', type=int, default=20,
+                        dest='entries', help="entries in every feed")
+    parser.add_argument('--paragraphs', type=int, default=8,
+                        dest='paragraphs', help="HTML paragraphs in every entry content")
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8],
+                        dest='workers', help="numbers of parser processes to compare, "
+                                             "0 parses in download threads")
+    parser.add_argument('--threads', type=int, default=DOWNLOAD_WORKERS,
+                        dest='threads', help="number of download threads handing feeds over")
+    return parser.parse_args()
+
+def make_feed(feed: int, entries: int, paragraphs: int) -> str:
+    """Generates RSS with full HTML content of every entry"""
+    published = formatdate(time.time(), usegmt=True)
+    items = []
+    for entry in range(entries):
+        content = "\n".join(f"<p>{' '.join(random.choices(WORDS, k=60))}</p>\n"
+                            f"<img src=\"https://example.com/{feed}/{entry}/{i}.png\"/>"
+                            for i in range(paragraphs))
+        items.append(f"<item><title>News {feed}/{entry}</title>"
+                     f"<link>https://example.com/{feed}/{entry}</link>"
+                     f"<description>{' '.join(random.choices(WORDS, k=40))}</description>"
+                     f"<content:encoded><![CDATA[{content}]]></content:encoded>"
+                     f"<pubDate>{published}</pubDate></item>")
+    return ('<?xml version="1.0"?><rss version="2.0" '
+            'xmlns:content="http://purl.org/rss/1.0/modules/content/"><channel>'
+            f'<title>Feed {feed}</title>{"".join(items)}</channel></rss>')
+
+def run(texts: dict[str, str], workers: int, threads: int) -> tuple[float, int]:
+    """Parses all feeds from download-like threads"""
+    start = time.perf_counter()
+    parser = FeedParser(workers)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        entries = sum(len(result) for result in
+                      executor.map(parser.parse, texts.values(), texts.keys()))
+    parser.close()
+    return time.perf_counter() - start, entries
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(42)
+    texts = {f"Feed {feed}": make_feed(feed, args.entries, args.paragraphs)
+             for feed in range(args.feeds)}
+    print(f"{args.feeds} feeds of {sum(map(len, texts.values())) / args.feeds / 1024:.0f}KB, "
+          f"{args.threads} download threads, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'time':>8} {'feeds/s':>8} {'entries/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        elapsed, entries = run(texts, workers, args.threads)
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>7.2f}s {args.feeds / elapsed:>8.1f} "
+              f"{entries / elapsed:>10.0f} {baseline / elapsed:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Offline end-to-end benchmark of generate stages on local feeds and a fake OpenAI server
+
+Without network tiktoken can not download its encoding, token counts are then approximate:
+    DIGEST_APPROXIMATE_TOKENS=1 python -m benchmarks.pipeline --scales 100 1000
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+import openai
+import requests
+
+from benchmarks.fake_openai import FakeOpenAI
+from digest.cache import ResponseCache
+from digest.feed import FeedLoader, DOWNLOAD_WORKERS, DOWNLOAD_BUDGET, PARSE_WORKERS, HEADERS
+from digest.metrics import metrics
+from digest import generate, gpt, tokens
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ("study", "patients", "results", "company", "announced", "data", "phase", "trial",
+         "approval", "treatment", "disease", "researchers", "funding", "round", "market",
+         "cells", "protein", "clinical", "drug", "development", "program", "shares", "report")
+STAGES = [('feeds', 'feed.iter_feeds'), ('parse', 'feed.parse'), ('filter', 'feed.filter'),
+          ('summarize', 'generate.summarize'), ('dedup', 'feed.deduplicate'),
+          ('topics', 'generate.make_topics'), ('summaries', 'generate.topic_summaries'),
+          ('highlights', 'generate.highlights'), ('links', 'generate.fix_links')]
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.pipeline")
+    parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 10000],
+                        dest='scales', help="numbers of synthetic feed entries, up to 100000")
+    parser.add_argument('--entries-per-feed', type=int, default=50,
+                        dest='entries_per_feed', help="entries in every synthetic feed")
+    parser.add_argument('--match-rate', type=float, default=0.02,
+                        dest='match_rate', help="share of synthetic entries matching keywords")
+    parser.add_argument('--fixtures', required=False,
+                        dest='fixtures', help="directory of recorded feeds to use instead of "
+                                              "synthetic ones")
+    parser.add_argument('--keywords', required=False,
+                        dest='keywords', help="keywords file for recorded feeds")
+    parser.add_argument('--record', required=False,
+                        dest='record', help="download feeds of sources directory into this "
+                                            "directory and exit")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        dest='latency', help="fake OpenAI response delay, seconds")
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        dest='token_latency', help="fake OpenAI delay per completion token")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        dest='rate_limit', help="probability of 429 response of fake OpenAI")
+    parser.add_argument('--rpm', type=int, default=0,
+                        dest='rpm', help="requests per minute limit of fake OpenAI")
+    parser.add_argument('--limited-models', nargs='*', default=[], metavar='MODEL',
+                        dest='limited_models', help="models always rate limited by fake OpenAI")
+    parser.add_argument('--model-policy', choices=gpt.ROUTING_POLICIES, default='quality',
+                        dest='policy', help="GPT models routing policy")
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                        dest='workers', help="number of concurrent feed downloads")
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS,
+                        dest='parse_workers', help="number of processes parsing feeds")
+    parser.add_argument('--gpt-workers', type=int, default=gpt.GPT_WORKERS,
+                        dest='gpt_workers', help="number of concurrent GPT requests")
+    parser.add_argument('--batch-tokens', type=int, default=0,
+                        dest='batch_tokens', help="summarize several entries per request")
+    parser.add_argument('--clustering', choices=generate.CLUSTERING, default='gpt',
+                        dest='clustering', help="way to group entries into topics")
+    parser.add_argument('--warm', action='store_true',
+                        dest='warm', help="repeat every run with feed and response caches")
+    parser.add_argument('--seed', type=int, default=42,
+                        dest='seed', help="random seed")
+    parser.add_argument('--output', required=False,
+                        dest='output', help="path to save results as JSON")
+    parser.add_argument('--compare', required=False,
+                        dest='compare', help="JSON results of another commit to compare with")
+    return parser.parse_args()
+
+def make_feeds(directory: str, size: int, entries_per_feed: int, match_rate: float,
+               keywords: list[str]) -> list[str]:
+    """Writes synthetic RSS feeds, a share of entries mentions two keywords"""
+    names = []
+    published = formatdate(time.time(), usegmt=True)
+    for feed in range((size + entries_per_feed - 1) // entries_per_feed):
+        items = []
+        for entry in range(feed * entries_per_feed, min(size, (feed + 1) * entries_per_feed)):
+            words = random.choices(WORDS, k=80)
+            if random.random() < match_rate:
+                words[10], words[50] = random.sample(keywords, 2)
+            items.append(f"<item><title>News {entry}: {' '.join(words[:6])}</title>"
+                         f"<link>https://example.com/{feed}/{entry}</link>"
+                         f"<description>{escape(' '.join(words))}</description>"
+                         f"<pubDate>{published}</pubDate></item>")
+        names.append(f"feed{feed:05}.xml")
+        with open(os.path.join(directory, names[-1]), "w", encoding="utf8") as file:
+            file.write('<?xml version="1.0"?><rss version="2.0"><channel>'
+                       f'<title>Feed {feed}</title>{"".join(items)}</channel></rss>')
+    return names
+
+def record(directory: str):
+    """Downloads feeds of the configured sources for later offline runs"""
+    os.makedirs(directory, exist_ok=True)
+    for name, url in FeedLoader().sources.items():
+        try:
+            response = requests.get(url, headers=HEADERS, timeout=30)
+        except requests.RequestException as error:
+            print(f"{name}: {error}")
+            continue
+        path = os.path.join(directory, "".join(char if char.isalnum() else "_" for char in name))
+        with open(f"{path}.xml", "w", encoding="utf8") as file:
+            file.write(response.text)
+        print(f"{name}: {len(response.text)} bytes")
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Static files handler without access log"""
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory: str) -> ThreadingHTTPServer:
+    """Serves feeds directory on a free local port"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler,
+                                                                     directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def prepare_workdir(workdir: str, feeds: list[str], port: int, keywords_path: str):
+    """Creates sources, keywords and prompts of a run directory"""
+    os.makedirs(os.path.join(workdir, 'sources'))
+    os.makedirs(os.path.join(workdir, 'keywords'))
+    with open(os.path.join(workdir, 'sources', 'bench.csv'), "w", encoding="utf8") as file:
+        file.writelines(f"{name};http://127.0.0.1:{port}/{name}\n" for name in feeds)
+    shutil.copy(keywords_path, os.path.join(workdir, 'keywords', 'bench.txt'))
+    os.symlink(os.path.join(REPO_DIR, 'prompts'), os.path.join(workdir, 'prompts'))
+
+def run(name: str, workdir: str, args) -> dict:
+    """Runs generate in the directory and collects stage timings"""
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        metrics.reset()
+        tokens.usage = tokens.TokenUsage()
+        gpt.configure(args.gpt_workers, 10 ** 9, 10 ** 9, cache=ResponseCache(),
+                      policy=args.policy)
+        start = time.perf_counter()
+        generate.generate('digest.md', True, True, True, args.workers, DOWNLOAD_BUDGET,
+                          True, args.batch_tokens, None, args.clustering, args.parse_workers)
+        total = time.perf_counter() - start
+        gpt.response_cache.close()
+        report = metrics.report('benchmark')
+    finally:
+        os.chdir(cwd)
+    result = {'name': name, 'total': total,
+              'requests': sum(stage['requests'] for stage in report['tokens'].values()),
+              'entries': report['counters'].get('filter.new.out', 0)}
+    for stage, span in STAGES:
+        result[stage] = report['spans'].get(span, {}).get('seconds', 0.0)
+    return result
+
+def print_results(results: list[dict], previous: list[dict] = None):
+    """Prints a table of stage timings and changes against previous results"""
+    previous = {result['name']: result for result in previous or []}
+    columns = [stage for stage, _ in STAGES] + ['total']
+    print(f"{'run':>16} {'entries':>7} {'requests':>8} " +
+          " ".join(f"{column:>10}" for column in columns))
+    for result in results:
+        print(f"{result['name']:>16} {result['entries']:>7} {result['requests']:>8} " +
+              " ".join(f"{result[column]:>9.2f}s" for column in columns))
+        if result['name'] in previous:
+            before = previous[result['name']]
+            print(f"{'change':>16} {'':>7} {'':>8} " +
+                  " ".join(f"{(result[column] - before[column]) / before[column]:>+10.0%}"
+                           if before[column] > 0.01 else f"{'':>10}" for column in columns))
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    if args.record:
+        record(args.record)
+        return
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(args.seed)
+    fake = FakeOpenAI(0, args.latency, args.token_latency, args.rate_limit, args.rpm,
+                      args.limited_models).start()
+    openai.api_base = fake.api_base
+    openai.api_key = openai.api_key or 'fake'
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        keywords_path = os.path.join(root, 'keywords.txt')
+        if args.fixtures:
+            shutil.copy(args.keywords or os.path.join('keywords', 'keywords.txt'), keywords_path)
+            runs = [('recorded', args.fixtures, sorted(name for name in os.listdir(args.fixtures)
+                                                       if name.endswith('.xml')))]
+        else:
+            keywords = [f"Keyword{i}" for i in range(200)]
+            with open(keywords_path, "w", encoding="utf8") as file:
+                file.writelines(f"{keyword}\n" for keyword in keywords)
+            runs = []
+            for size in args.scales:
+                directory = os.path.join(root, f"feeds-{size}")
+                os.makedirs(directory)
+                runs.append((str(size), directory, make_feeds(directory, size,
+                                                              args.entries_per_feed,
+                                                              args.match_rate, keywords)))
+        for name, directory, feeds in runs:
+            server = serve(directory)
+            workdir = os.path.join(root, f"run-{name}")
+            prepare_workdir(workdir, feeds, server.server_address[1], keywords_path)
+            results.append(run(f"{name} cold", workdir, args))
+            if args.warm:
+                results.append(run(f"{name} warm", workdir, args))
+            server.shutdown()
+            server.server_close()
+    fake.shutdown()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf8") as file:
+            previous = json.load(file)['results']
+    print(f"latency {args.latency}s, rate limit {args.rate_limit}, {args.gpt_workers} GPT workers, "
+          f"{args.parse_workers} parse workers, batch tokens {args.batch_tokens}, "
+          f"{args.clustering} clustering, {args.policy} model policy, "
+          f"{fake.stats['rate_limited']} requests rate limited")
+    print("requests by model: " + ", ".join(f"{model} {requests}" for model, requests
+                                            in sorted(fake.stats['models'].items())))
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as file:
+            json.dump({'args': vars(args), 'results': results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
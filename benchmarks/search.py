@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Index build time and query latency of the digest archive search"""
+import argparse
+import http.client
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from digest import server
+from benchmarks.server_load import QuietHandler
+
+WORDS = ("antibody", "protein", "trial", "vaccine", "genome", "crispr", "cell", "therapy",
+         "oncology", "enzyme", "startup", "funding", "biomarker", "receptor", "peptide",
+         "sequencing", "microbiome", "antigen", "lipid", "kinase", "neuron", "stem", "virus")
+VOCABULARY = WORDS + tuple(f"{word}{i}" for i in range(200) for word in WORDS)
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.search")
+    parser.add_argument('--digests', type=int, default=365,
+                        dest='digests', help="number of digests per language")
+    parser.add_argument('--queries', type=int, default=2000,
+                        dest='queries', help="number of search requests")
+    parser.add_argument('--clients', type=int, default=8,
+                        dest='clients', help="number of concurrent clients")
+    return parser.parse_args()
+
+def make_digests(root: str, size: int):
+    """Writes synthetic digests with Zipf distributed vocabulary into the root"""
+    rnd = random.Random(0)
+    for language in server.LANGUAGES:
+        os.makedirs(os.path.join(root, language))
+        for day in range(size):
+            with open(os.path.join(root, language, f"digest-{day:04}.md"), "w",
+                      encoding="utf-8") as file:
+                file.write("# Biotech News Report\n\n" + "\n".join(
+                    f"## Topic {topic}\n\n" + "\n".join(
+                        f"{i}. " + " ".join(rnd.choices(VOCABULARY, WEIGHTS, k=12)) +
+                        f" [link](https://example.com/{day}/{topic}/{i})"
+                        for i in range(1, 7)) + "\n" for topic in range(10)))
+
+def client(port: int, queries: list, latencies: list, lock: threading.Lock):
+    """Sends search requests and records their latency"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    measured = []
+    for query in queries:
+        start = time.perf_counter()
+        connection.request("GET", f"/search?q={quote(query)}")
+        connection.getresponse().read()
+        measured.append(time.perf_counter() - start)
+    connection.close()
+    with lock:
+        latencies.extend(measured)
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as root:
+        make_digests(root, args.digests)
+        server.archive = server.Archive(root)
+        start = time.perf_counter()
+        server.search_index = server.SearchIndex(os.path.join(root, server.SEARCH_INDEX))
+        server.search_index.update(root)
+        print(f"Index of {args.digests * len(server.LANGUAGES)} digests built in "
+              f"{time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        server.search_index.update(root)
+        print(f"Unchanged archive checked in {(time.perf_counter() - start) * 1000:.1f}ms")
+        server.search_index = server.SearchIndex(os.path.join(root, server.SEARCH_INDEX),
+                                                 readonly=True)
+
+        httpd = server.PooledHTTPServer(("127.0.0.1", 0), QuietHandler, server.WORKERS)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        rnd = random.Random(1)
+        queries = [" ".join(rnd.choices(VOCABULARY, WEIGHTS, k=rnd.randint(1, 3)))
+                   for _ in range(args.queries)]
+        latencies, lock = [], threading.Lock()
+        threads = [threading.Thread(target=client, args=(httpd.server_address[1],
+                                                         queries[i::args.clients], latencies, lock))
+                   for i in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        httpd.shutdown()
+        httpd.server_close()
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} queries by {args.clients} clients: {len(latencies) / elapsed:.1f} "
+          f"requests/s, p50 {percentiles[49] * 1000:.1f}ms, p95 {percentiles[94] * 1000:.1f}ms, "
+          f"p99 {percentiles[98] * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Load test of the digest web server in single-threaded and pooled modes"""
+import argparse
+import http.client
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+from digest import server
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.server_load")
+    parser.add_argument('--clients', type=int, default=32,
+                        dest='clients', help="number of concurrent clients")
+    parser.add_argument('--slow-clients', type=int, default=2,
+                        dest='slow_clients', help="clients holding connections without requests")
+    parser.add_argument('--idle-clients', type=int, default=64,
+                        dest='idle_clients', help="keep-alive connections left idle after a request")
+    parser.add_argument('--duration', type=float, default=5,
+                        dest='duration', help="seconds to run every mode")
+    parser.add_argument('--workers', type=int, default=server.WORKERS,
+                        dest='workers', help="server worker threads in pooled mode")
+    return parser.parse_args()
+
+class QuietHandler(server.MarkdownRequestHandler):
+    """Handler without access log"""
+    def log_message(self, format, *args):
+        pass
+
+class SingleHandler(QuietHandler):
+    """Previous behaviour: HTTP/1.0 without keep-alive"""
+    protocol_version = "HTTP/1.0"
+
+def make_digests(root: str, size: int = 30):
+    """Writes synthetic digests into the root"""
+    for language in server.LANGUAGES:
+        os.makedirs(os.path.join(root, language))
+        for day in range(1, size + 1):
+            with open(os.path.join(root, language, f"{day:02}-10-2026.md"), "w",
+                      encoding="utf-8") as file:
+                file.write("# Biotech News Report\n\n" + "\n".join(
+                    f"## Topic {topic}\n\n" + "\n".join(
+                        f"{i}. Some news about antibodies and trials [link](https://example.com/{i})"
+                        for i in range(1, 7)) + "\n" for topic in range(10)))
+
+def client(port: int, deadline: float, counter: list, lock: threading.Lock):
+    """Requests digests until the deadline"""
+    done = 0
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while time.monotonic() < deadline:
+        try:
+            connection.request("GET", f"/en/{done % 30 + 1:02}-10-2026",
+                               headers={"Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            response.read()
+            if response.will_close:
+                connection.close()
+            done += 1
+        except (OSError, http.client.HTTPException):
+            connection.close()
+    connection.close()
+    with lock:
+        counter[0] += done
+
+def idle_wait(port: int, idle_clients: int) -> float:
+    """Leaves keep-alive connections idle after a request, returns how long
+    a new client waits for its response"""
+    idle = []
+    for _ in range(idle_clients):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        connection.request("GET", "/en/01-10-2026")
+        connection.getresponse().read()
+        idle.append(connection)
+    start = time.monotonic()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", "/en/02-10-2026")
+    connection.getresponse().read()
+    elapsed = time.monotonic() - start
+    for connection in idle + [connection]:
+        connection.close()
+    return elapsed
+
+def run(name: str, httpd, clients: int, slow_clients: int, idle_clients: int,
+        duration: float):
+    """Serves requests of concurrent clients and prints throughput"""
+    port = httpd.server_address[1]
+    httpd.handle_error = lambda request, client_address: None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    slow = [socket.create_connection(("127.0.0.1", port)) for _ in range(slow_clients)]
+    for connection in slow:
+        connection.sendall(b"GET /en/01-10-2026 HTTP/1.1\r\n")
+    counter, lock = [0], threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=client, args=(port, deadline, counter, lock))
+               for _ in range(clients)]
+    for client_thread in threads:
+        client_thread.start()
+    for client_thread in threads:
+        client_thread.join()
+    for connection in slow:
+        connection.close()
+    waited = idle_wait(port, idle_clients)
+    httpd.shutdown()
+    httpd.server_close()
+    print(f"{name:8} {counter[0] / duration:10.1f} requests/s "
+          f"{waited:8.2f}s wait after {idle_clients} idle connections")
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as root:
+        make_digests(root)
+        server.archive = server.Archive(root)
+        print(f"{args.clients} clients, {args.slow_clients} slow clients, "
+              f"{args.duration}s per mode")
+        socketserver.TCPServer.allow_reuse_address = True
+        run("single", socketserver.TCPServer(("127.0.0.1", 0), SingleHandler),
+            args.clients, args.slow_clients, args.idle_clients, args.duration)
+        run("pooled", server.PooledHTTPServer(("127.0.0.1", 0), QuietHandler,
+                                              args.workers),
+            args.clients, args.slow_clients, args.idle_clients, args.duration)
+
+if __name__ == "__main__":
+    main()
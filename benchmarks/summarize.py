@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares per-entry and batched summaries against a local fake OpenAI server"""
+import argparse
+import random
+import time
+
+import openai
+
+from benchmarks.fake_openai import FakeOpenAI
+from digest.feed import FeedEntrie
+from digest.metrics import metrics
+from digest import gpt, tokens
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("benchmarks.summarize")
+    parser.add_argument('--entries', type=int, default=200,
+                        dest='entries', help="number of synthetic entries")
+    parser.add_argument('--words', type=int, default=150,
+                        dest='words', help="words per entry")
+    parser.add_argument('--batch-tokens', type=int, default=3000,
+                        dest='batch_tokens', help="tokens budget of a batch")
+    parser.add_argument('--latency', type=float, default=0.5,
+                        dest='latency', help="fake server response delay, seconds")
+    parser.add_argument('--workers', type=int, default=gpt.GPT_WORKERS,
+                        dest='workers', help="number of concurrent GPT requests")
+    parser.add_argument('--inline', action='store_true',
+                        dest='inline', help="fake server answers batches as \"1. summary\" lines")
+    return parser.parse_args()
+
+def make_entries(size: int, words: int) -> list[FeedEntrie]:
+    """Generates entries with random lorem-like content"""
+    vocabulary = ["antibody", "trial", "Phase", "FDA", "approval", "cell", "therapy",
+                  "biotech", "funding", "Series", "oncology", "patients", "data", "results"]
+    return [FeedEntrie(f"Entry {i}", " ".join(random.choices(vocabulary, k=words)),
+                       None, f"https://example.com/{i}") for i in range(size)]
+
+def run(name: str, entries: list[FeedEntrie], batch_tokens: int, workers: int):
+    """Runs summarize and prints wall time and token usage"""
+    gpt.configure(workers=workers)
+    tokens.usage = tokens.TokenUsage()
+    metrics.reset()
+    start = time.perf_counter()
+    summaries = gpt.summarize(entries, batch_tokens)
+    elapsed = time.perf_counter() - start
+    assert len(summaries) == len(entries)
+    totals = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    for stage in tokens.usage.stages.values():
+        for key in totals:
+            totals[key] += stage[key]
+    print(f"{name:10} {elapsed:8.2f}s {totals['requests']:6} requests "
+          f"{totals['prompt_tokens']:9} prompt tokens {totals['completion_tokens']:8} completion tokens "
+          f"{metrics.counters.get('gpt.batch_fallbacks', 0):4} batch fallbacks")
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    server = FakeOpenAI(0, latency=args.latency, inline=args.inline).start()
+    openai.api_base = server.api_base
+    openai.api_key = openai.api_key or 'fake'
+    print(f"{args.entries} entries, {args.words} words each, {args.workers} workers")
+    random.seed(42)
+    run("per-entry", make_entries(args.entries, args.words), 0, args.workers)
+    random.seed(42)
+    run("batched", make_entries(args.entries, args.words), args.batch_tokens, args.workers)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -3,25 +3,32 @@
 OUTPUT_PATH="$DIGEST_PATH/markdown"
 
 FILENAME=$(date "+%d-%m-%Y.md")
-ENGLISH="--english"
-RUSSIAN="--russian"
+ENGLISH="en"
+RUSSIAN="ru"
 
 source $CONDA_PATH/etc/profile.d/conda.sh
 conda activate digest
 cd $DIGEST_PATH
 
 if [[ -z "${TEST_RUN}" ]]; then
-    python -m digest.generate --summaries --highlights
-    python -m digest.translate
-else
-    ENGLISH=""
-    RUSSIAN=""
+    SEND=""
+    if [[ -z "${NO_POST}" ]]; then
+        SEND="--send en $ENGLISH --send ru $RUSSIAN"
+    fi
+    python -m digest.run --summaries --highlights --languages ru \
+        --root $OUTPUT_PATH --only-highlights $SEND
+    exit $?
 fi
 
+ENGLISH="test"
+RUSSIAN="test"
+
 cp $DIGEST_PATH/.last-digest-en.md $OUTPUT_PATH/en/$FILENAME
 cp $DIGEST_PATH/.last-digest-ru.md $OUTPUT_PATH/ru/$FILENAME
+python -m digest.server --prerender --root $OUTPUT_PATH
 
 if [[ -z "${NO_POST}" ]]; then
-    python -m digest.telegram $ENGLISH --only-highlights --input $OUTPUT_PATH/en/$FILENAME
-    python -m digest.telegram $RUSSIAN --only-highlights --input $OUTPUT_PATH/ru/$FILENAME
+    python -m digest.telegram --only-highlights \
+        --send $ENGLISH $OUTPUT_PATH/en/$FILENAME \
+        --send $RUSSIAN $OUTPUT_PATH/ru/$FILENAME
 fi
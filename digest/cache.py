@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Persistent caches for downloaded feeds and GPT responses"""
+
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import argparse
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger()
+
+CACHE_DIR = '.cache'
+FEED_CACHE_DIR = os.path.join(CACHE_DIR, 'feeds')
+FEED_CACHE_SIZE = int(os.getenv("DIGEST_FEED_CACHE_SIZE", "2000"))
+FEED_CACHE_TTL = float(os.getenv("DIGEST_FEED_CACHE_TTL_DAYS", "7")) * 24 * 60 * 60
+RESPONSE_CACHE_PATH = os.path.join(CACHE_DIR, 'responses.sqlite')
+RESPONSE_CACHE_SIZE = 256 * 1024 * 1024
+RESPONSE_CACHE_TTL = 30 * 24 * 60 * 60
+TRANSLATION_MEMORY_PATH = os.path.join(CACHE_DIR, 'translations.sqlite')
+TRANSLATION_MEMORY_TTL = 180 * 24 * 60 * 60
+SQL_BATCH_SIZE = 500
+
+FeedCacheItem = namedtuple('FeedCacheItem', ['etag', 'modified', 'body', 'feed'])
+
+class FeedCache:
+    """Keeps validators, raw body and parsed feed for every source URL on disk"""
+    def __init__(self, path: str = FEED_CACHE_DIR, max_size: int = FEED_CACHE_SIZE,
+                 ttl: float = FEED_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        os.makedirs(self.path, exist_ok=True)
+
+    def get(self, url: str) -> FeedCacheItem:
+        """Returns cached item for the URL or None if it is absent or expired"""
+        path = self._item_path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as descriptor:
+                return pickle.load(descriptor)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put(self, url: str, etag: str, modified: str, body: str, feed):
+        """Stores response validators, body and parsed feed for the URL"""
+        path = self._item_path(url)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as descriptor:
+            pickle.dump(FeedCacheItem(etag, modified, body, feed), descriptor)
+        os.replace(tmp_path, path)
+
+    def touch(self, url: str):
+        """Marks cached item for the URL as revalidated"""
+        try:
+            os.utime(self._item_path(url))
+        except OSError:
+            pass
+
+    def evict(self):
+        """Removes expired items and the oldest ones above the size limit"""
+        now = time.time()
+        items = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    items.append((mtime, path))
+            except OSError:
+                continue
+        items.sort(reverse=True)
+        for _, path in items[self.max_size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        logging.info(f"Feed cache keeps {min(len(items), self.max_size)} sources")
+
+    def _item_path(self, url: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf8')).hexdigest())
+
+class ResponseCache:
+    """Keeps GPT responses in SQLite keyed by model, prompt name and prompts text"""
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_size: int = RESPONSE_CACHE_SIZE,
+                 ttl: float = RESPONSE_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                       key TEXT PRIMARY KEY, model TEXT, prompt TEXT,
+                                       content TEXT, size INTEGER,
+                                       created REAL, accessed REAL)""")
+
+    def get(self, model: str, prompt: str, system_prompt: str, user_prompt: str) -> str:
+        """Returns cached response content or None"""
+        key = response_key(model, prompt, system_prompt, user_prompt)
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT content, created FROM responses WHERE key = ?",
+                                          (key,)).fetchone()
+            if not row:
+                return None
+            if time.time() - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?",
+                                    (time.time(), key))
+        return row[0]
+
+    def put(self, model: str, prompt: str, system_prompt: str, user_prompt: str, content: str):
+        """Stores response content"""
+        key = response_key(model, prompt, system_prompt, user_prompt)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (key, model, prompt, content,
+                                     len(content.encode('utf8')), now, now))
+
+    def evict(self):
+        """Removes expired responses and least recently used ones above the size limit"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses WHERE created < ?",
+                                    (time.time() - self.ttl,))
+            total = 0
+            expired = []
+            for key, size in self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed DESC"):
+                total += size
+                if total > self.max_size:
+                    expired.append((key,))
+            self.connection.executemany("DELETE FROM responses WHERE key = ?", expired)
+
+    def stats(self) -> list[tuple]:
+        """Returns number of responses and their size per model and prompt"""
+        with self.lock:
+            return self.connection.execute("""SELECT model, prompt, COUNT(*), SUM(size),
+                                              MIN(created), MAX(accessed)
+                                              FROM responses GROUP BY model, prompt""").fetchall()
+
+    def clear(self):
+        """Removes all responses"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses")
+
+    def close(self):
+        """Closes database connection"""
+        self.connection.close()
+
+class TranslationMemory:
+    """Keeps translations of digest segments in SQLite keyed by normalized text and language"""
+    def __init__(self, path: str = TRANSLATION_MEMORY_PATH, ttl: float = TRANSLATION_MEMORY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS segments (
+                                       key TEXT PRIMARY KEY, language TEXT,
+                                       source TEXT, translation TEXT, used REAL)""")
+
+    def get(self, segments: list[str], language: str) -> dict[str, str]:
+        """Returns known translations of the segments"""
+        keys = {segment_key(segment, language): segment for segment in segments}
+        translations = {}
+        batches = [list(keys)[i:i + SQL_BATCH_SIZE] for i in range(0, len(keys), SQL_BATCH_SIZE)]
+        with self.lock, self.connection:
+            for batch in batches:
+                for key, translation in self.connection.execute(
+                        f"SELECT key, translation FROM segments "
+                        f"WHERE key IN ({','.join('?' * len(batch))})", batch):
+                    translations[keys[key]] = translation
+            self.connection.executemany("UPDATE segments SET used = ? WHERE key = ?",
+                                        [(time.time(), segment_key(segment, language))
+                                         for segment in translations])
+        return translations
+
+    def put(self, translations: dict[str, str], language: str):
+        """Stores translations of the segments"""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?)",
+                                        [(segment_key(segment, language), language,
+                                          segment, translation, now)
+                                         for segment, translation in translations.items()])
+
+    def evict(self):
+        """Removes segments not used during ttl"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM segments WHERE used < ?", (time.time() - self.ttl,))
+
+    def stats(self) -> list[tuple]:
+        """Returns number of segments per language"""
+        with self.lock:
+            return self.connection.execute("""SELECT language, COUNT(*), MIN(used), MAX(used)
+                                              FROM segments GROUP BY language""").fetchall()
+
+    def clear(self):
+        """Removes all segments"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM segments")
+
+    def close(self):
+        """Closes database connection"""
+        self.connection.close()
+
+def normalize_segment(text: str) -> str:
+    """Collapses whitespace of the segment"""
+    return " ".join(text.split())
+
+def segment_key(segment: str, language: str) -> str:
+    """Content address of a segment translation"""
+    digest = hashlib.sha256(normalize_segment(segment).encode('utf8')).hexdigest()
+    return f"{language}:{digest}"
+
+def response_key(model: str, prompt: str, system_prompt: str, user_prompt: str) -> str:
+    """Content address of a GPT request"""
+    digest = hashlib.sha256()
+    for part in (system_prompt or '', user_prompt):
+        digest.update(part.encode('utf8'))
+        digest.update(b'\0')
+    return f"{model}:{prompt}:{digest.hexdigest()}"
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("digest.cache")
+    parser.add_argument('command', choices=['stats', 'evict', 'clear'],
+                        help="show cache statistics, evict old entries or clear caches")
+    parser.add_argument('--responses', required=False, default=RESPONSE_CACHE_PATH,
+                        dest='responses', help="path of GPT responses cache")
+    parser.add_argument('--feeds', required=False, default=FEED_CACHE_DIR,
+                        dest='feeds', help="path of feeds cache")
+    parser.add_argument('--translations', required=False, default=TRANSLATION_MEMORY_PATH,
+                        dest='translations', help="path of translation memory")
+    return parser.parse_args()
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    responses = ResponseCache(args.responses)
+    feeds = FeedCache(args.feeds)
+    translations = TranslationMemory(args.translations)
+    if args.command == 'evict':
+        responses.evict()
+        feeds.evict()
+        translations.evict()
+    elif args.command == 'clear':
+        responses.clear()
+        translations.clear()
+        feeds.max_size = 0
+        feeds.evict()
+    for model, prompt, count, size, created, accessed in responses.stats():
+        print(f"{model}\t{prompt}\t{count} responses\t{size} bytes\t"
+              f"{time.ctime(created)} - {time.ctime(accessed)}")
+    for language, count, used_first, used_last in translations.stats():
+        print(f"translations\t{language}\t{count} segments\t"
+              f"{time.ctime(used_first)} - {time.ctime(used_last)}")
+    print(f"feeds\t{len(os.listdir(feeds.path))} sources")
+    responses.close()
+    translations.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Outputs of finished run stages kept on disk, so a failed run resumes from them"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import date
+
+from digest.cache import CACHE_DIR
+from digest.feed import FeedEntrie, dict_entrie
+from digest.metrics import write_atomic
+
+logger = logging.getLogger()
+
+RUNS_DIR = os.path.join(CACHE_DIR, 'runs')
+RUNS_RETENTION_DAYS = 14
+
+class RunDirectory:
+    """Saves and loads stage checkpoints, JSON ones by .json extension and texts otherwise.
+    Without a path nothing is kept"""
+    def __init__(self, path: str = None):
+        self.path = path
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def has(self, name: str) -> bool:
+        """Checks that the stage checkpoint exists"""
+        return bool(self.path) and os.path.exists(os.path.join(self.path, name))
+
+    def load(self, name: str):
+        """Loads the stage checkpoint"""
+        logging.info(f"Resuming from {name} checkpoint of {self.path}")
+        with open(os.path.join(self.path, name), 'r', encoding='utf8') as descriptor:
+            return json.load(descriptor) if name.endswith('.json') else descriptor.read()
+
+    def save(self, name: str, value):
+        """Writes the stage checkpoint atomically"""
+        if not self.path:
+            return
+        write_atomic(os.path.join(self.path, name),
+                     json.dumps(value, ensure_ascii=False, default=str)
+                     if name.endswith('.json') else value)
+
+    def clear(self):
+        """Forgets all checkpoints of the run"""
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path, exist_ok=True)
+
+def dump_entries(entries: list[FeedEntrie]) -> list[dict]:
+    """Converts entries to JSON-ready dicts"""
+    return [dict_entrie(entrie) for entrie in entries]
+
+def load_entries(dicts: list[dict]) -> list[FeedEntrie]:
+    """Restores entries from their dicts"""
+    return [FeedEntrie(item['title'], item['content'],
+                       date.fromisoformat(item['date']) if item['date'] else None, item['url'])
+            for item in dicts]
+
+def evict_runs(root: str = RUNS_DIR, retention_days: int = RUNS_RETENTION_DAYS):
+    """Removes run directories older than retention days"""
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if time.time() - os.path.getmtime(path) > retention_days * 24 * 60 * 60:
+            shutil.rmtree(path, ignore_errors=True)
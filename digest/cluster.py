@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local clustering of texts by TF-IDF similarity"""
+
+import re
+import math
+import zlib
+import logging
+from collections import Counter
+
+import numpy as np
+
+from digest.metrics import metrics
+
+logger = logging.getLogger()
+
+SIMILARITY_THRESHOLD = 0.15
+MAX_FEATURES = 4096
+TERM = re.compile(r"[^\W\d_][\w\-]*[^\W_]")
+STOP_WORDS = frozenset("""
+about after also among and are been before being between both but can could did does during
+each for from had has have her his how its into itself may more most new not now off one only
+other our out over said she should such than that the their them then there these they this
+those through too under until very was were what when where which while who why will with
+would you your
+""".split())
+
+def terms(text: str) -> list[str]:
+    """Lowercased words without stop words and their adjacent pairs"""
+    words = [word for word in TERM.findall(text.lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+@metrics.timed('cluster.vectorize')
+def vectorize(texts: list[str], max_features: int = MAX_FEATURES) -> np.ndarray:
+    """Unit length TF-IDF vectors of texts. Only terms shared by several texts get
+    a column, the others can't make texts similar and only count in the length.
+    If there are more shared terms than max_features, they are hashed into columns"""
+    counts = [Counter(terms(text)) for text in texts]
+    frequencies = Counter(term for count in counts for term in count)
+    shared = [term for term, frequency in frequencies.items() if frequency > 1]
+    if len(shared) <= max_features:
+        columns = {term: column for column, term in enumerate(shared)}
+    else:
+        columns = {term: zlib.crc32(term.encode()) % max_features for term in shared}
+    vectors = np.zeros((len(texts), min(len(shared), max_features)), dtype=np.float32)
+    norms = np.zeros(len(texts), dtype=np.float32)
+    for row, count in enumerate(counts):
+        for term, frequency in count.items():
+            weight = (1 + math.log(frequency)) * \
+                     (1 + math.log((1 + len(texts)) / (1 + frequencies[term])))
+            norms[row] += weight ** 2
+            column = columns.get(term)
+            if column is not None:
+                vectors[row, column] += weight
+    norms = np.sqrt(norms)
+    norms[norms == 0] = 1
+    return vectors / norms[:, None]
+
+@metrics.timed('cluster.agglomerate')
+def agglomerate(vectors: np.ndarray, max_cluster_size: int,
+                threshold: float = SIMILARITY_THRESHOLD) -> list[list[int]]:
+    """Average linkage clustering of vectors by cosine similarity, merges clusters
+    while they are similar enough and never lets them exceed max_cluster_size.
+    Returns rows of every cluster, larger clusters first"""
+    size = len(vectors)
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, -np.inf)
+    # The most similar neighbour of every cluster, only rows touched by a merge are rescanned
+    partners = similarity.argmax(axis=1)
+    best = similarity[np.arange(size), partners]
+    sizes = np.ones(size, dtype=np.int64)
+    members = [[row] for row in range(size)]
+    while size > 1:
+        first = int(np.argmax(best))
+        second = int(partners[first])
+        if best[first] < threshold:
+            break
+        merged = (sizes[first] * similarity[first] + sizes[second] * similarity[second]) / \
+                 (sizes[first] + sizes[second])
+        sizes[first] += sizes[second]
+        sizes[second] = 0
+        members[first] += members[second]
+        members[second] = []
+        merged[sizes + sizes[first] > max_cluster_size] = -np.inf
+        merged[[first, second]] = -np.inf
+        similarity[first], similarity[:, first] = merged, merged
+        similarity[second], similarity[:, second] = -np.inf, -np.inf
+
+        stale = (partners == first) | (partners == second)
+        improved = merged > best
+        best[improved], partners[improved] = merged[improved], first
+        stale &= ~improved
+        stale[first], stale[second] = True, False
+        rows = np.flatnonzero(stale)
+        partners[rows] = similarity[rows].argmax(axis=1)
+        best[rows] = similarity[rows, partners[rows]]
+        best[second] = -np.inf
+    clusters = [sorted(rows) for rows in members if rows]
+    return sorted(clusters, key=lambda rows: (-len(rows), rows[0]))
+
+def cluster_texts(texts: list[str], max_cluster_size: int,
+                  threshold: float = SIMILARITY_THRESHOLD) -> list[list[int]]:
+    """Groups indices of similar texts"""
+    if not texts:
+        return []
+    clusters = agglomerate(vectorize(texts), max_cluster_size, threshold)
+    logging.info(f"{len(texts)} texts were grouped into {len(clusters)} clusters")
+    return clusters
@@ -3,32 +3,104 @@
 """This module helps to prepare a RSS feed by downloading and filtering by keywords"""
 
 import os
+import sys
 import csv
 import re
+import math
+import time
+import queue
 import logging
-from collections import namedtuple
+import datetime
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlparse
 
 import requests
 import feedparser
+from requests.adapters import HTTPAdapter
 from dateutil.parser import parse as parsedate
 
+from digest.cache import FeedCache
+from digest.keywords import KeywordMatcher
+from digest.metrics import metrics
+from digest.seen import SeenStore
+
 logger = logging.getLogger()
 
 SOURCES_DIR = 'sources'
 KEYWORDS_DIR = 'keywords'
 MATCHES = 2
 
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_HOST_LIMIT = 2
+DOWNLOAD_BUDGET = 300
+PARSE_WORKERS = os.cpu_count() if (os.cpu_count() or 1) > 1 else 0
+
 HEADERS = {'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) \
 AppleWebKit/537.36 (KHTML, like Gecko) \
 Chrome/112.0.0.0 Safari/537.36'}
 
-FeedEntrie = namedtuple('FeedEntrie', ['title', 'content', 'date', 'url'])
+class FeedEntrie:
+    """Feed entrie with only the fields digest needs, stages update it in place.
+    Description is the raw text keyword filters match, it is kept only if it differs
+    from content. Source is an interned feed name"""
+    __slots__ = ('title', 'content', 'date', 'url', 'source', 'description')
+
+    def __init__(self, title: str, content: str, date, url: str,
+                 source: str = None, description: str = None):
+        self.title = title
+        self.content = content
+        self.date = date
+        self.url = url
+        self.source = source
+        self.description = description
+
+    def __repr__(self):
+        return f"FeedEntrie(title={self.title!r}, url={self.url!r}, source={self.source!r})"
+
+class FeedParser:
+    """Parses feed texts in a pool of processes, only compact entries come back.
+    Without workers feeds are parsed in the calling thread. Workers are started
+    by a fork server, since forking a process with running download and GPT threads
+    may copy locks they hold"""
+    def __init__(self, workers: int = PARSE_WORKERS):
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=parse_context()) \
+                    if workers > 0 else None
+
+    def parse(self, text: str, feed_name: str) -> list[FeedEntrie]:
+        """Parses feed text, blocks until it is done"""
+        with metrics.span('feed.parse'):
+            if self.pool is None:
+                return parse_feed(text, feed_name)
+            entries = self.pool.submit(parse_feed, text, feed_name).result()
+        source = sys.intern(feed_name)
+        for entrie in entries:
+            entrie.source = source
+        return entries
+
+    def close(self):
+        """Stops worker processes"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+def parse_context():
+    """Multiprocessing context starting clean worker processes"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
 
 class FeedLoader:
     """Loads and filters RSS feeds"""
-    def __init__(self, sources=None):
+    def __init__(self, sources=None, cache: FeedCache = None, seen: SeenStore = None,
+                 parse_workers: int = PARSE_WORKERS):
         self.sources = {}
+        self.cache = cache
+        self.seen = seen
+        self.parse_workers = parse_workers
         self.regexps = []
+        self.matcher = None
         self.fixed_sources = False
         self._reload_regexps()
 
@@ -49,74 +121,183 @@ class FeedLoader:
         else:
             logging.info("Sources reloading skipped")
 
-    def download(self):
-        """Downloads recent feeds"""
+    @metrics.timed('feed.download')
+    def download(self, workers: int = DOWNLOAD_WORKERS, host_limit: int = DOWNLOAD_HOST_LIMIT,
+                 budget: float = DOWNLOAD_BUDGET):
+        """Downloads recent feeds concurrently within a wall-clock budget"""
+        self.feeds = dict(self.iter_feeds(workers, host_limit, budget))
+
+    def iter_feeds(self, workers: int = DOWNLOAD_WORKERS, host_limit: int = DOWNLOAD_HOST_LIMIT,
+                   budget: float = DOWNLOAD_BUDGET):
+        """Downloads feeds concurrently and yields entries of non-empty ones
+        as soon as they are parsed"""
+        limits = {}
+        for feed_url in self.sources.values():
+            host = urlparse(feed_url).netloc
+            if host not in limits:
+                limits[host] = threading.BoundedSemaphore(host_limit)
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(limits) or 1, pool_maxsize=host_limit)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(HEADERS)
+
+        start = time.perf_counter()
+        deadline = time.monotonic() + budget
+        parser = FeedParser(self.parse_workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(self._download_feed, session, parser, feed_name, feed_url,
+                                   limits[urlparse(feed_url).netloc], deadline): feed_name
+                   for feed_name, feed_url in self.sources.items()}
+        # Finished downloads wait in the queue, so time the consumer spends on entries
+        # is not counted against the budget, it only stops feeds still being downloaded
+        finished = queue.Queue()
+        for future in futures:
+            future.add_done_callback(finished.put)
+        pending = len(futures)
+        try:
+            while pending:
+                try:
+                    future = finished.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    logging.warning(f"Download budget of {budget}s exceeded, "
+                                    f"{pending} feeds skipped")
+                    metrics.count('feed.skipped', pending)
+                    break
+                pending -= 1
+                entries = future.result()
+                if entries:
+                    yield futures[future], entries
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            parser.close()
+            session.close()
+            if self.cache:
+                self.cache.evict()
+            metrics.observe('feed.iter_feeds', time.perf_counter() - start)
+
+    def stream(self, workers: int = DOWNLOAD_WORKERS, host_limit: int = DOWNLOAD_HOST_LIMIT,
+               budget: float = DOWNLOAD_BUDGET, since=None):
+        """Yields new deduplicated entries containing keywords as soon as their feed is parsed"""
         self.feeds = {}
-        for feed_name, feed_url in self.sources.items():
+        contents = set()
+        total = 0
+        for feed_name, entries in self.iter_feeds(workers, host_limit, budget):
+            total += len(entries)
+            with metrics.span('feed.filter'):
+                metrics.count('filter.fresh.in', len(entries))
+                if since is not None:
+                    entries = [entrie for entrie in entries if self.is_fresh(entrie, since)]
+                metrics.count('filter.fresh.out', len(entries))
+                metrics.count('filter.actual.in', len(entries))
+                entries = [entrie for entrie in entries if self.is_actual(entrie)]
+                metrics.count('filter.actual.out', len(entries))
+            if not entries:
+                continue
+            self.feeds[feed_name] = entries
+            for entrie in entries:
+                metrics.count('filter.new.in')
+                if entrie.content not in contents and self._is_new(entrie):
+                    contents.add(entrie.content)
+                    metrics.count('filter.new.out')
+                    yield entrie
+        logging.info(f"Total entries: {total}, streamed after filtering: {len(contents)}")
+
+    @metrics.timed('feed.download_feed')
+    def _download_feed(self, session, parser, feed_name, feed_url, limit, deadline):
+        with limit:
+            if time.monotonic() > deadline:
+                return None
+            cached = self.cache.get(feed_url) if self.cache else None
+            headers = {}
+            if cached and cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached and cached.modified:
+                headers['If-Modified-Since'] = cached.modified
             try:
                 logging.info(f"Loading {feed_name} feed")
-                response = requests.get(feed_url, headers=HEADERS, timeout=10)
-                feed = feedparser.parse(response.text)
-                if len(feed.entries) > 0:
-                    self.feeds[feed_name] = feed
-            except requests.ReadTimeout: 
-                logging.warning(f"Error while loading {feed_name} feed")
+                response = session.get(feed_url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+                if cached and response.status_code == 304:
+                    logging.info(f"Feed {feed_name} was not modified, using cache")
+                    metrics.count('feed.not_modified')
+                    self.cache.touch(feed_url)
+                    return cached_entries(cached, feed_name)
+                if cached and response.text == cached.body:
+                    metrics.count('feed.unchanged')
+                    entries = cached_entries(cached, feed_name)
+                else:
+                    entries = parser.parse(response.text, feed_name)
+                metrics.count('feed.downloaded')
+                if self.cache and response.ok:
+                    self.cache.put(feed_url, response.headers.get('ETag'),
+                                   response.headers.get('Last-Modified'), response.text, entries)
+                return entries
+            except requests.RequestException as error:
+                logging.warning(f"Error while loading {feed_name} feed: {error}")
+                metrics.count('feed.errors')
+        return None
 
     def logentries(self):
         """Log total number of entries"""
-        total = sum(len(feed.entries) for feed in self.feeds.values())
+        total = sum(len(entries) for entries in self.feeds.values())
         logging.info(f"Total entries: {total}")
 
     def cleanup(self):
         """Removes all feeds with zero entries"""
         logging.info("Cleaning empty feeds")
-        new_feeds = {}
-        for feed_name, feed in self.feeds.items():
-            if len(feed.entries) > 0:
-                new_feeds[feed_name] = feed
-        self.feeds = new_feeds
+        self.feeds = {feed_name: entries for feed_name, entries in self.feeds.items() if entries}
 
+    @metrics.timed('feed.keepfresh')
     def keepfresh(self, date):
         """Keeps only fresh entries"""
         logging.info("Filtering feeds by date")
-        for _, feed in self.feeds.items():
-            entries = []
-            for entrie in feed.entries:
-                try:
-                    entrie_date = parsedate(entrie['published']).date()
-                    if entrie_date > date:
-                        entries.append(entrie)
-                except KeyError:
-                    entries.append(entrie)
-            feed.entries = entries
+        for feed_name, entries in self.feeds.items():
+            self.feeds[feed_name] = [entrie for entrie in entries if self.is_fresh(entrie, date)]
+            metrics.count('filter.fresh.in', len(entries))
+            metrics.count('filter.fresh.out', len(self.feeds[feed_name]))
+
+    def is_fresh(self, entrie, date) -> bool:
+        """Checks that the entrie is published after the date or has no date"""
+        return entrie.date is None or entrie.date > date
 
+    @metrics.timed('feed.keepactual')
     def keepactual(self):
         """Keeps only entries that contain keywords"""
         logging.info("Filtering feeds by keywords")
-        for _, feed in self.feeds.items():
-            entries = []
-            for entrie in feed.entries:
-                matches = sum(1 for regexp in self.regexps if regexp.search(entrie.title) or \
-                                                              regexp.search(entrie.description))
-                if matches >= MATCHES:
-                    entries.append(entrie)
-            feed.entries = entries
+        for feed_name, entries in self.feeds.items():
+            self.feeds[feed_name] = [entrie for entrie in entries if self.is_actual(entrie)]
+            metrics.count('filter.actual.in', len(entries))
+            metrics.count('filter.actual.out', len(self.feeds[feed_name]))
 
+    def is_actual(self, entrie) -> bool:
+        """Checks that the entrie contains enough keywords"""
+        description = entrie.content if entrie.description is None else entrie.description
+        return self.matcher.count(entrie.title, description, limit=MATCHES) >= MATCHES
+
+    @metrics.timed('feed.dump')
     def dump(self):
         """Dumps feed entries"""
-        result = []
-        for feed in self.feeds.values():
-            for entrie in feed.entries:
-                result.append(make_entrie(entrie))
+        result = [entrie for entries in self.feeds.values() for entrie in entries]
         result_contents = set()
         result_dedup = []
         for entrie in result:
-            if entrie.content not in result_contents:
+            if entrie.content not in result_contents and self._is_new(entrie):
                 result_contents.add(entrie.content)
                 result_dedup.append(entrie)
+        metrics.count('filter.new.in', len(result))
+        metrics.count('filter.new.out', len(result_dedup))
         logging.info(f"Total deduplicated entries dumped: {len(result_dedup)}")
         return result_dedup
 
+    def _is_new(self, entrie) -> bool:
+        if not self.seen:
+            return True
+        if not self.seen.is_new(entrie.url, entrie.content):
+            return False
+        self.seen.mark(entrie.url, entrie.content, entrie.title)
+        return True
+
     def _reload_sources(self):
         self.sources = {}
         for root, _, files in os.walk(SOURCES_DIR):
@@ -132,20 +313,35 @@ class FeedLoader:
                 if file.endswith('.txt'):
                     logging.info(f"Loading keywords from '{file}'")
                     self.regexps.extend(load_keywordsfile(os.path.join(root, file)))
+        self.matcher = KeywordMatcher(self.regexps)
+
+def parse_feed(text: str, feed_name: str) -> list[FeedEntrie]:
+    """Parses feed text keeping only the fields of entries digest needs"""
+    source = sys.intern(feed_name)
+    return [make_entrie(entrie, source) for entrie in feedparser.parse(text).entries]
 
-def make_entrie(entrie):
+def cached_entries(cached, feed_name: str) -> list[FeedEntrie]:
+    """Entries of a feed cache item, items of older versions keep a whole parsed feed"""
+    if isinstance(cached.feed, list):
+        return cached.feed
+    return parse_feed(cached.body, feed_name)
+
+def make_entrie(entrie, source: str = None):
     """Converts feedparser entries to FeedEntrie structure"""
-    title = entrie.title
+    title = entrie.get('title', '')
+    description = entrie.get('description', '')
     try:
         content = clear_content(entrie.content[0]['value'])
     except AttributeError:
-        content = clear_content(entrie.description)
+        content = clear_content(description)
+    date = entrie.get('published_parsed')
     try:
-        date = parsedate(entrie.published).date()
-    except AttributeError:
+        date = datetime.date(*date[:3]) if date else parsedate(entrie.published).date()
+    except (AttributeError, ValueError, OverflowError):
         date = None
-    url = entrie.link
-    return FeedEntrie(title, content, date, url)
+    url = entrie.get('link')
+    return FeedEntrie(title, content, date, url, source,
+                      None if description == content else description)
 
 def dict_entrie(entrie):
     """Convers FeedEntrie to a dict"""
@@ -183,36 +379,76 @@ def clear_content(text):
         newlines.append(line)
     return " ".join(newlines)
 
+@metrics.timed('feed.deduplicate')
 def deduplicate_entries(entries):
     """Deduplicate entries by simple heuristic"""
-    capitals= set(chr(i) for i in range(ord('A'), ord('Z') + 1))
+    duplicates = find_duplicates(entries)
+    for duplicate, original in duplicates.items():
+        logging.info(f"Entry '{entries[duplicate].title}' duplicates '{entries[original].title}'")
+    metrics.count('filter.duplicates.in', len(entries))
+    metrics.count('filter.duplicates.out', len(entries) - len(duplicates))
+    return [entrie for i, entrie in enumerate(entries) if i not in duplicates]
 
-    keywords = []
-    for entrie in entries:
-        keywords.append(set(word for word in entrie.content.split() if word[0] in capitals))
+def find_duplicates(entries, threshold: float = 0.8):
+    """Maps every duplicated entry index to the earliest entry it duplicates.
+    Entries are near-duplicates if they share at least threshold of the
+    capitalized words of the shorter one. Words are ordered from the rarest, and the
+    shorter set of a duplicate pair has one of its prefix words in the other set,
+    so only prefixes are indexed and probed, and candidates are verified exactly"""
+    capitals = set(chr(i) for i in range(ord('A'), ord('Z') + 1))
+    keywords = [set(word for word in entrie.content.split() if word[0] in capitals)
+                for entrie in entries]
+    frequencies = Counter(word for words in keywords for word in words)
 
-    duplicates = set()
-    for i in range(len(entries)):
-        for j in range(i+1, len(entries)):
-            least = min(len(keywords[i]), len(keywords[j]))
-            union = len(keywords[i].intersection(keywords[j]))
-            if union >= 0.8 * least:
-                duplicates.add(j)
+    prefix_index = {}
+    words_index = {}
+    first_empty = None
+    duplicates = {}
+    for j, words in enumerate(keywords):
+        ordered = sorted(words, key=lambda word: (frequencies[word], word))
+        prefix = ordered[:len(ordered) - math.ceil(threshold * len(ordered)) + 1]
+        # Earlier shorter entries by their prefixes and earlier longer ones by our prefix
+        candidates = set()
+        for word in words:
+            candidates.update(prefix_index.get(word, ()))
+        for word in prefix:
+            candidates.update(words_index.get(word, ()))
 
-    return [entrie for i, entrie in enumerate(entries) if i not in duplicates]
+        matches = [i for i in candidates if len(keywords[i] & words) >=
+                   threshold * min(len(keywords[i]), len(words))]
+        if first_empty is not None:
+            matches.append(first_empty)
+        if not words and j > 0:
+            matches.append(0)
+        if matches:
+            duplicates[j] = min(matches)
+
+        if not words and first_empty is None:
+            first_empty = j
+        for word in prefix:
+            prefix_index.setdefault(word, []).append(j)
+        for word in words:
+            words_index.setdefault(word, []).append(j)
+    return duplicates
 
 def change_content(entrie, content):
-    """Change the content, keep other"""
-    return FeedEntrie(entrie.title, content, entrie.date, entrie.url)
+    """Changes the content in place, keeps other"""
+    entrie.content = content
+    return entrie
+
+def topic_list(entries: list[FeedEntrie]) -> str:
+    """Numbered list of entries with links to sources"""
+    return "\n".join(f"{i}. {entrie.content} [link]({entrie.url})"
+                     for i, entrie in enumerate(entries, start=1))
 
-def algorithmic_digest(clusters: dict[str, list[FeedEntrie]], summaries: list[str] = None):
-    """Make digest from clusters"""
+def algorithmic_digest(clusters: dict[str, list[FeedEntrie]], summaries: dict[str, str] = None,
+                       lists: dict[str, str] = None):
+    """Make digest from clusters, lists replace generated lists of their topics"""
     result = []
     for topic, entries in clusters.items():
         result.append(f"## {topic}\n")
         if summaries:
             result.append(f"{summaries[topic]}\n")
-        for i, entrie in enumerate(entries, start=1):
-            result.append(f"{i}. {entrie.content} [link]({entrie.url})")
+        result.append(lists[topic] if lists and topic in lists else topic_list(entries))
         result.append("\n")
     return "\n".join(result)
@@ -1,15 +1,23 @@
 """Digest generation using GPT"""
 import argparse
 import logging
+from datetime import date, timedelta
 
-from digest.feed import FeedLoader, deduplicate_entries, algorithmic_digest
+from digest.feed import FeedLoader, deduplicate_entries, algorithmic_digest, dict_entrie, \
+                        topic_list, DOWNLOAD_WORKERS, DOWNLOAD_BUDGET, PARSE_WORKERS
+from digest.checkpoints import RunDirectory, dump_entries, load_entries
+from digest.cache import FeedCache, ResponseCache, FEED_CACHE_SIZE, FEED_CACHE_TTL
+from digest.seen import SeenStore, RETENTION_DAYS
 from digest.io import dump_digest, ENGLISH_DIGEST
-from digest import gpt
+from digest.metrics import metrics
+from digest import gpt, tokens
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', datefmt='%d.%m.%Y %H:%M:%S')
 
+CLUSTERING = {'gpt': gpt.make_topics, 'local': gpt.make_local_topics}
+
 
 def get_args():
     """Get command line args"""
@@ -22,64 +30,180 @@ def get_args():
                         dest='highlights', help="add daily highlights")
     parser.add_argument('--fix-links', action='store_true',
                         dest='fix_links', help="fix meshed up links")
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                        dest='workers', help="number of concurrent feed downloads")
+    parser.add_argument('--budget', type=float, default=DOWNLOAD_BUDGET,
+                        dest='budget', help="time limit for downloading all feeds, seconds")
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS,
+                        dest='parse_workers', help="number of processes parsing feeds, "
+                                                   "0 parses them in download threads")
+    parser.add_argument('--no-cache', action='store_false',
+                        dest='use_cache', help="do not use feeds and responses caches")
+    parser.add_argument('--feed-cache-size', type=int, default=FEED_CACHE_SIZE,
+                        dest='feed_cache_size', help="maximal number of sources in feeds cache")
+    parser.add_argument('--feed-cache-ttl', type=float, default=FEED_CACHE_TTL / (24 * 60 * 60),
+                        dest='feed_cache_ttl', help="days to keep feeds in cache")
+    parser.add_argument('--gpt-workers', type=int, default=gpt.GPT_WORKERS,
+                        dest='gpt_workers', help="number of concurrent GPT requests")
+    parser.add_argument('--tpm', type=int, default=gpt.TOKENS_PER_MINUTE,
+                        dest='tpm', help="GPT tokens per minute limit")
+    parser.add_argument('--rpm', type=int, default=gpt.REQUESTS_PER_MINUTE,
+                        dest='rpm', help="GPT requests per minute limit")
+    parser.add_argument('--model-policy', choices=gpt.ROUTING_POLICIES, default='quality',
+                        dest='policy', help="pick GPT models by stage preference, "
+                                            "lower cost or lower latency")
+    parser.add_argument('--batch-tokens', type=int, default=0,
+                        dest='batch_tokens', help="summarize several entries per request "
+                                                  "within this tokens budget")
+    parser.add_argument('--clustering', choices=CLUSTERING, default='gpt',
+                        dest='clustering', help="group entries into topics by a single gpt-4 "
+                                                "request or locally, asking GPT only to name them")
+    parser.add_argument('--all-entries', action='store_false',
+                        dest='only_new', help="process entries seen by previous runs too")
+    parser.add_argument('--retention', type=int, default=RETENTION_DAYS,
+                        dest='retention', help="days to remember seen entries, "
+                                               "older entries are skipped")
+    parser.add_argument('--report', required=False,
+                        dest='report', help="path of JSON run report, "
+                                            "by default it is kept in .cache/reports")
+    parser.add_argument('--prometheus', required=False,
+                        dest='prometheus', help="path of Prometheus textfile with run metrics")
     return parser.parse_args()
 
-def get_entries():
-    """Downloads feeds and generates filtered list of entries"""
-    loader = FeedLoader()
-    loader.download()
-    loader.logentries()
-    loader.keepactual()
-    loader.cleanup()
-    loader.logentries()
-    return loader.dump()
+def get_entries(workers: int = DOWNLOAD_WORKERS, budget: float = DOWNLOAD_BUDGET,
+                use_cache: bool = True, seen: SeenStore = None,
+                parse_workers: int = PARSE_WORKERS, feed_cache_size: int = FEED_CACHE_SIZE,
+                feed_cache_ttl: float = FEED_CACHE_TTL):
+    """Downloads feeds and yields filtered entries as soon as their feed is parsed"""
+    cache = FeedCache(max_size=feed_cache_size, ttl=feed_cache_ttl) if use_cache else None
+    loader = FeedLoader(cache=cache, seen=seen,
+                        parse_workers=parse_workers)
+    since = date.today() - timedelta(days=seen.retention_days) if seen else None
+    return loader.stream(workers=workers, budget=budget, since=since)
+
+def checkpointed_entries(entries, run: RunDirectory):
+    """Passes entries through and saves them into the run once they are all yielded"""
+    streamed = []
+    for entrie in entries:
+        streamed.append(dict_entrie(entrie))
+        yield entrie
+    run.save('entries.json', streamed)
+
+def topic_summaries(clusters: dict, run: RunDirectory) -> dict[str, str]:
+    """Writes a summary for each topic"""
+    with metrics.span('generate.topic_summaries'):
+        if run.has('topic-summaries.json'):
+            return run.load('topic-summaries.json')
+        summaries = gpt.make_topic_summaries(clusters)
+        run.save('topic-summaries.json', summaries)
+        return summaries
+
+def highlights(clusters: dict, run: RunDirectory) -> str:
+    """Makes highlights from the digest without topic summaries"""
+    with metrics.span('generate.highlights'):
+        if run.has('highlights.md'):
+            return run.load('highlights.md')
+        result = gpt.make_highlights(algorithmic_digest(clusters))
+        run.save('highlights.md', result)
+        return result
+
+def fixed_lists(clusters: dict, run: RunDirectory) -> dict[str, str]:
+    """Fixes links of every topic list"""
+    with metrics.span('generate.fix_links'):
+        if run.has('links.json'):
+            return run.load('links.json')
+        lists = gpt.fix_links({topic: topic_list(entries) for topic, entries in clusters.items()})
+        run.save('links.json', lists)
+        return lists
 
 def generate(output: str, add_summaries: bool = True,
-             add_highlights: bool = True, fix_links: bool = True):
-    """Generate new digest by entries list"""
-    entries = get_entries()
+             add_highlights: bool = True, fix_links: bool = True,
+             workers: int = DOWNLOAD_WORKERS, budget: float = DOWNLOAD_BUDGET,
+             use_cache: bool = True, batch_tokens: int = 0, seen: SeenStore = None,
+             clustering: str = 'gpt', parse_workers: int = PARSE_WORKERS,
+             run: RunDirectory = None, feed_cache_size: int = FEED_CACHE_SIZE,
+             feed_cache_ttl: float = FEED_CACHE_TTL):
+    """Generate new digest by entries list, stages finished in the run are not repeated"""
     digest = None
-
+    run = run or RunDirectory()
+    if seen and run.has('entries.json'):
+        for entrie in run.load('entries.json'):
+            seen.mark(entrie['url'], entrie['content'], entrie['title'])
+
+    # Generate summaries for every entrie while feeds are being downloaded
+    with metrics.span('generate.summarize'):
+        if run.has('summaries.json'):
+            entries = load_entries(run.load('summaries.json'))
+        else:
+            if run.has('entries.json'):
+                entries = load_entries(run.load('entries.json'))
+            else:
+                entries = checkpointed_entries(get_entries(workers, budget, use_cache, seen,
+                                                           parse_workers, feed_cache_size,
+                                                           feed_cache_ttl), run)
+            entries = gpt.summarize(entries, batch_tokens)
+            run.save('summaries.json', dump_entries(entries))
     if len(entries) == 0:
         logging.warning("No fresh news after applying filters")
         return digest
 
-    # Generate summaries for every entrie
-    entries = gpt.summarize(entries)
-
     # Deduplicate entries by simple algorithmic logic 
     entries = deduplicate_entries(entries)
 
     # Clusterize entries by topics
-    clusters = gpt.make_topics(entries)
+    with metrics.span('generate.make_topics'):
+        if run.has('clusters.json'):
+            clusters = {topic: load_entries(cluster)
+                        for topic, cluster in run.load('clusters.json').items()}
+        else:
+            clusters = CLUSTERING[clustering](entries)
+            if clusters:
+                run.save('clusters.json', {topic: dump_entries(cluster)
+                                           for topic, cluster in clusters.items()})
     if not clusters:
         return digest
-
-    # Write a summary for each topic
-    summaries = gpt.make_topic_summaries(clusters) if add_summaries else None
+    metrics.count('generate.topics', len(clusters))
+    metrics.count('generate.entries', sum(len(cluster) for cluster in clusters.values()))
 
     # Generate a digest
-    digest = algorithmic_digest(clusters, summaries)
+    digest = algorithmic_digest(clusters)
     dump_digest(digest, custom_path=output)
-
-    # Make highlights for the digest
+    if seen:
+        seen.commit()
+
+    # Write topic summaries, highlights and fixed links concurrently, all of them need
+    # only clusters. Highlights are made from entries summaries without topic summaries
+    stages = {}
+    if add_summaries or run.has('topic-summaries.json'):
+        stages['summaries'] = lambda: topic_summaries(clusters, run)
     if add_highlights:
-        highlights = gpt.make_highlights(digest)
-        digest = f"# Biotech News Report\n\nDaily highlights:\n\n{highlights}\n\n{digest}"
-        dump_digest(digest, custom_path=output)
-
-    # Fixes links to sources
+        stages['highlights'] = lambda: highlights(clusters, run)
     if fix_links:
-        digest = gpt.fix_links(digest)
-        dump_digest(digest, custom_path=output)
+        stages['links'] = lambda: fixed_lists(clusters, run)
+    results = gpt.executor.fanout(stages)
+    digest = algorithmic_digest(clusters, results.get('summaries'), results.get('links'))
+    if add_highlights:
+        digest = f"# Biotech News Report\n\nDaily highlights:\n\n" \
+                 f"{results['highlights']}\n\n{digest}"
+    dump_digest(digest, custom_path=output)
 
     return digest
 
 def main():
     """Entrie point"""
     args = get_args()
+    gpt.configure(args.gpt_workers, args.tpm, args.rpm,
+                  cache=ResponseCache() if args.use_cache else None, policy=args.policy)
     output_path = args.output if args.output else ENGLISH_DIGEST
-    print(generate(output_path, args.summaries, args.highlights, args.fix_links))
+    seen = SeenStore(retention_days=args.retention) if args.only_new else None
+    print(generate(output_path, args.summaries, args.highlights, args.fix_links,
+                   args.workers, args.budget, args.use_cache, args.batch_tokens, seen,
+                   args.clustering, args.parse_workers, None, args.feed_cache_size,
+                   args.feed_cache_ttl * 24 * 60 * 60))
+    tokens.usage.log()
+    if gpt.response_cache:
+        gpt.response_cache.evict()
+    metrics.dump('generate', args.report, args.prometheus)
 
 if __name__ == "__main__":
     main()
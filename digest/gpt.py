@@ -3,108 +3,387 @@
 """GPT requests"""
 
 import os
+import re
 import sys
 import json
+import time
+import random
 import logging
-import tiktoken
+import threading
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 import openai
 from openai.error import RateLimitError
 
+from digest.cache import ResponseCache
 from digest.feed import FeedEntrie, change_content
 from digest.io import load_prompt
+from digest.metrics import metrics
+from digest import cluster, tokens
 
 logger = logging.getLogger()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2
+BACKOFF_MAX = 60
+GPT_WORKERS = 8
+TOKENS_PER_MINUTE = 80000
+REQUESTS_PER_MINUTE = 200
+TRANSLATE_CHUNK_TOKENS = 1500
+FALLBACK_AFTER = 2
+FALLBACK_COOLDOWN = 60
+LATENCY_SMOOTHING = 0.3
+ROUTING_POLICIES = ('quality', 'cost', 'latency')
+DEFAULT_ROUTE = ('gpt-3.5-turbo', 'gpt-3.5-turbo-16k', 'gpt-4', 'gpt-4-32k')
+STAGE_ROUTES = {
+    'cluster': ('gpt-4', 'gpt-4-32k', 'gpt-3.5-turbo-16k'),
+    'highlights': ('gpt-4', 'gpt-4-32k', 'gpt-3.5-turbo-16k'),
+    'links': ('gpt-4', 'gpt-4-32k', 'gpt-3.5-turbo-16k'),
+    'translate': ('gpt-4', 'gpt-4-32k', 'gpt-3.5-turbo-16k'),
+}
+LINK_TARGET = re.compile(r'\]\(([^)\s]+)\)')
+
+class RateLimiter:
+    """Blocks requests exceeding token-per-minute and request-per-minute budgets"""
+    def __init__(self, tokens_per_minute: int = TOKENS_PER_MINUTE,
+                 requests_per_minute: int = REQUESTS_PER_MINUTE, window: float = 60):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self.history = deque()
+        self.tokens = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, tokens: int):
+        """Waits until the request fits into the budgets and accounts it"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.history and now - self.history[0][0] >= self.window:
+                    self.tokens -= self.history.popleft()[1]
+                fits_tokens = self.tokens + tokens <= self.tokens_per_minute or not self.history
+                if len(self.history) < self.requests_per_minute and fits_tokens:
+                    self.history.append((now, tokens))
+                    self.tokens += tokens
+                    return
+                self.condition.wait(self.history[0][0] + self.window - now)
+
+rate_limiter = RateLimiter()
+
+class Router:
+    """Picks models for every request by its stage, prompt size and policy: quality keeps
+    the stage preference, cost prefers the cheapest model and latency the fastest one so far.
+    Models answering with repeated rate limits are put aside for a cooldown"""
+    def __init__(self, policy: str = 'quality', fallback_after: int = FALLBACK_AFTER,
+                 cooldown: float = FALLBACK_COOLDOWN):
+        self.policy = policy
+        self.fallback_after = fallback_after
+        self.cooldown = cooldown
+        self.latencies = {}
+        self.rate_limits = {}
+        self.cooling = {}
+        self.lock = threading.Lock()
+
+    def route(self, stage: str, model: str, tokens_size: int) -> list[str]:
+        """Models able to take the prompt, the chosen one first and fallbacks after it.
+        If the prompt fits none of them, only the model with the largest context is left"""
+        models = list(dict.fromkeys((model,) + STAGE_ROUTES.get(stage, DEFAULT_ROUTE)))
+        with self.lock:
+            if self.policy == 'cost':
+                models.sort(key=lambda name: tokens.cost(name, tokens_size, 0))
+            elif self.policy == 'latency':
+                # Models without answers yet come first, so each of them gets measured
+                models.sort(key=lambda name: self.latencies.get(name, 0.0))
+            fitting = [name for name in models if tokens.prompt_limit(name) >= tokens_size] or \
+                      [max(models, key=tokens.prompt_limit)]
+            now = time.monotonic()
+            return sorted(fitting, key=lambda name: self.cooling.get(name, 0) > now)
+
+    def answered(self, model: str, seconds: float):
+        """Accounts a successful request of the model"""
+        with self.lock:
+            self.rate_limits[model] = 0
+            latency = self.latencies.get(model)
+            self.latencies[model] = seconds if latency is None else \
+                latency + LATENCY_SMOOTHING * (seconds - latency)
+
+    def rate_limited(self, model: str) -> bool:
+        """Accounts a rate limit error of the model, returns True when it is put aside"""
+        with self.lock:
+            self.rate_limits[model] = self.rate_limits.get(model, 0) + 1
+            if self.rate_limits[model] < self.fallback_after:
+                return False
+            self.rate_limits[model] = 0
+            self.cooling[model] = time.monotonic() + self.cooldown
+            return True
+
+model_router = Router()
+
+class Executor:
+    """Runs GPT requests concurrently keeping the input order of results"""
+    def __init__(self, workers: int = GPT_WORKERS):
+        self.workers = workers
+        # Bounds requests in flight when several stages run their own pools at once
+        self.slots = threading.BoundedSemaphore(max(workers, 1))
+
+    def map(self, gpt: 'GPT', user_prompts: list[str]) -> list[str]:
+        """Runs the GPT request for every user prompt"""
+        user_prompts = list(user_prompts)
+        total = sum(tokens.count_tokens(user_prompt, gpt.model) for user_prompt in user_prompts)
+        logging.info(f"Running {len(user_prompts)} {gpt.prompt} requests "
+                     f"with {total} user prompt tokens")
+        if self.workers <= 1 or len(user_prompts) <= 1:
+            return [gpt.request(user_prompt) for user_prompt in user_prompts]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(user_prompts))) as pool:
+            return list(pool.map(gpt.request, user_prompts))
+
+    def imap(self, gpt: 'GPT', user_prompts: Iterable[str], max_pending: int = None) -> Iterator[str]:
+        """Runs the GPT request for lazily produced user prompts and yields results
+        in order, consuming new prompts only while fewer than max_pending are running"""
+        max_pending = max_pending or 2 * self.workers
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            pending = deque()
+            for user_prompt in user_prompts:
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(gpt.request, user_prompt))
+            while pending:
+                yield pending.popleft().result()
+
+    def starmap(self, requests: list[tuple['GPT', str]]) -> list[str]:
+        """Runs requests of different GPT instances in one pool keeping the input order"""
+        requests = list(requests)
+        logging.info(f"Running {len(requests)} requests of "
+                     f"{', '.join(sorted({gpt.prompt for gpt, _ in requests}))}")
+        if self.workers <= 1 or len(requests) <= 1:
+            return [gpt.request(user_prompt) for gpt, user_prompt in requests]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(requests))) as pool:
+            return list(pool.map(lambda request: request[0].request(request[1]), requests))
+
+    def fanout(self, calls: dict[str, Callable]) -> dict:
+        """Runs independent stages concurrently, each of them sending its own requests"""
+        if self.workers <= 1 or len(calls) <= 1:
+            return {name: call() for name, call in calls.items()}
+        logging.info(f"Running {', '.join(calls)} concurrently")
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            futures = {name: pool.submit(call) for name, call in calls.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+executor = Executor()
+response_cache = None
+
+def configure(workers: int = GPT_WORKERS, tokens_per_minute: int = TOKENS_PER_MINUTE,
+              requests_per_minute: int = REQUESTS_PER_MINUTE, cache: ResponseCache = None,
+              policy: str = 'quality'):
+    """Sets concurrency, rate limits, responses cache and model routing policy
+    for all following requests"""
+    global executor, rate_limiter, response_cache, model_router
+    executor = Executor(workers)
+    rate_limiter = RateLimiter(tokens_per_minute, requests_per_minute)
+    response_cache = cache
+    model_router = Router(policy)
+
 class GPT:
-    """Make generic requests using GPT"""
-    def __init__(self, prompt: str, model: str = 'gpt-3.5-turbo', allow32k: bool = False):
+    """Make generic requests using GPT, the model is the preferred one of the stage
+    and the router may send a request to another one"""
+    def __init__(self, prompt: str, model: str = 'gpt-3.5-turbo'):
         self.prompt = prompt
         self.system_prompt = load_prompt(prompt)
         self.model = model
-        self.allow32k = allow32k
 
-    def request(self, user_prompt: str, max_attempts: int = 2) -> str:
-        """Run request"""
+    def request(self, user_prompt: str, max_attempts: int = MAX_ATTEMPTS,
+                validate: Callable[[str], bool] = None) -> str:
+        """Run request, responses rejected by validate are neither taken from
+        the cache nor stored there, so a retry asks GPT again"""
         content = None
+        tokens_size = tokens.count_tokens(self.system_prompt, self.model) + \
+                      tokens.count_tokens(user_prompt, self.model)
+        model, *fallbacks = model_router.route(self.prompt, self.model, tokens_size)
+        if response_cache:
+            content = response_cache.get(model, self.prompt, self.system_prompt, user_prompt)
+            if content is not None and validate and not validate(content):
+                logging.info(f"Cached response for {self.prompt} request is invalid, ignoring it")
+                content = None
+            if content is not None:
+                logging.info(f"Cached response for {self.prompt} request is used")
+                tokens.usage.add(self.prompt, cached=True)
+                return content
         logging.info(f"Sending {self.prompt} request to GPT")
-        response = request(self.system_prompt, user_prompt,
-                           model=self.model, allow32k=self.allow32k,
-                           max_attempts=max_attempts)
+        with executor.slots, metrics.span(f"gpt.{self.prompt}"):
+            response, answered = request(self.system_prompt, user_prompt, model=model,
+                                         max_attempts=max_attempts, fallbacks=fallbacks)
         if not response:
             logging.fatal("Response failed. Aboring.")
             sys.exit(1)
         content = response['choices'][0]['message']['content']
         logging.info("Response recieved")
+        tokens.usage.add(self.prompt, response['usage']['prompt_tokens'],
+                         response['usage']['completion_tokens'],
+                         model=response.get('model', answered))
+        if response_cache and answered == model and (not validate or validate(content)):
+            response_cache.put(model, self.prompt, self.system_prompt, user_prompt, content)
         return content
 
+def fit_prompt(system_prompt: str, user_prompt: str, model: str) -> tuple[str, int]:
+    """Truncates user prompt to the model limit, returns it with the prompt size in tokens"""
+    tokens_size = tokens.count_tokens(system_prompt, model) + tokens.count_tokens(user_prompt, model)
+    limit = tokens.prompt_limit(model)
+    if tokens_size > limit:
+        logging.warning(f"Text is too long ({tokens_size} tokens), truncating it to {limit} tokens")
+        metrics.count('gpt.truncated')
+        user_prompt = tokens.truncate(user_prompt, limit - tokens.count_tokens(system_prompt, model),
+                                      model)
+        tokens_size = limit
+    return user_prompt, tokens_size
+
 def request(system_prompt: str, user_prompt: str, model: str = 'gpt-4',
-            allow32k: str = False, max_attempts: int = 2):
-    """Runs request to OpenAI GPT API"""
+            max_attempts: int = MAX_ATTEMPTS, limiter: RateLimiter = None,
+            fallbacks: list[str] = (), router: Router = None):
+    """Runs request to OpenAI GPT API, switches to the next fallback model
+    once the router puts the current one aside after repeated rate limits.
+    Returns the response, None if all attempts failed, and the last requested model"""
     response = None
-    count_tokens = lambda x: len(tiktoken.encoding_for_model('gpt-4').encode(x))
-    tokens_size = count_tokens(system_prompt) + count_tokens(user_prompt)
-    if model == 'gpt-4' and tokens_size > 8196:
-        if allow32k:
-            logging.info(f"Text is too long ({tokens_size} tokens), switching request to gpt-4-32k")
-            model = 'gpt-4-32k'
-        else:
-            logging.error(f'Text is too long ({tokens_size} tokens)')
-            return response
+    limiter = limiter or rate_limiter
+    router = router or model_router
+    fallbacks = iter(fallbacks)
+    prompt, tokens_size = fit_prompt(system_prompt, user_prompt, model)
     logging.info(f"{tokens_size} tokens will be sent to {model} model")
     for i in range(1, max_attempts + 1):
+        limiter.acquire(tokens_size)
+        start = time.monotonic()
         try:
             response = openai.ChatCompletion.create(model=model, messages=[
                 {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
+                {'role': 'user', 'content': prompt}
             ])
+            router.answered(model, time.monotonic() - start)
+            metrics.count(f"gpt.model.{model}")
             break
         except RateLimitError:
             logging.warning("Rate limit error, server is busy")
+            metrics.count('gpt.rate_limited')
             if i == max_attempts:
                 logging.error("All attempts have been exhausted, request failed")
-                return response
-            else:
-                logging.info(f"Trying again: {i}/{max_attempts}")
-    return response
+                metrics.count('gpt.failed')
+                return response, model
+            metrics.count('gpt.retries')
+            fallback = next(fallbacks, None) if router.rate_limited(model) else None
+            if fallback:
+                logging.warning(f"{model} keeps answering with rate limits, "
+                                f"falling back to {fallback}")
+                metrics.count('gpt.fallbacks')
+                model = fallback
+                prompt, tokens_size = fit_prompt(system_prompt, user_prompt, model)
+                continue
+            delay = min(BACKOFF_MAX, BACKOFF_BASE ** i) * (1 + random.random()) / 2
+            logging.info(f"Trying again in {delay:.1f}s: {i}/{max_attempts}")
+            time.sleep(delay)
+    return response, model
 
 def content_prompt(entries: list[FeedEntrie]) -> str:
     """Creates a text of enumerated paragraphs"""
     return "\n".join(f"{idx}\n{entrie.content}\n"
                      for idx, entrie in enumerate(entries, start=1))
 
+def parse_content(text: str, size: int) -> list[str]:
+    """Parses a text of enumerated paragraphs, a number is either alone on its line
+    or followed by a dot, colon or bracket and the paragraph, returns None if numbers are wrong"""
+    parts = re.split(r'^[ \t]*(\d+)(?:[.:)]?[ \t]*$|[.:)][ \t]+)', text, flags=re.MULTILINE)
+    numbers = [int(number) for number in parts[1::2]]
+    paragraphs = [paragraph.strip() for paragraph in parts[2::2]]
+    if parts[0].strip() or numbers != list(range(1, size + 1)) or not all(paragraphs):
+        return None
+    return paragraphs
+
+def make_batches(entries: Iterable[FeedEntrie], max_tokens: int,
+                 model: str) -> Iterator[list[FeedEntrie]]:
+    """Packs consecutive entries into batches fitting max_tokens of content prompt"""
+    batch, batch_size = [], 0
+    for entrie in entries:
+        size = tokens.count_tokens(f"{len(batch) + 1}\n{entrie.content}\n", model) + 1
+        if batch and batch_size + size > max_tokens:
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(entrie)
+        batch_size += size
+    if batch:
+        yield batch
+
 # GPT requests
 
-def summarize(entries: list[FeedEntrie]) -> list[FeedEntrie]:
-    """Summarizes content of every given entrie"""
-    summary = GPT('summary')
-    logging.info(f'Running {len(entries)} summary tasks')
-    new_entries = [change_content(entrie, summary.request(entrie.content)) for entrie in entries]
-    logging.info('All tasks were finished')
+def summarize(entries: Iterable[FeedEntrie], batch_tokens: int = 0) -> list[FeedEntrie]:
+    """Summarizes content of every given entrie, several entries per request
+    if batch_tokens budget is set"""
+    if batch_tokens:
+        new_entries = list(summarize_batches(entries, batch_tokens))
+    else:
+        new_entries = list(summarize_stream(entries))
+    logging.info(f'All {len(new_entries)} summary tasks were finished')
     return new_entries
 
+def summarize_stream(entries: Iterable[FeedEntrie]) -> Iterator[FeedEntrie]:
+    """Summarizes entries while they are being produced"""
+    summary = GPT('summary')
+    queued = deque()
+    def contents():
+        for entrie in entries:
+            queued.append(entrie)
+            yield entrie.content
+    for content in executor.imap(summary, contents()):
+        yield change_content(queued.popleft(), content)
+
+def summarize_batches(entries: Iterable[FeedEntrie], batch_tokens: int) -> Iterator[FeedEntrie]:
+    """Summarizes entries packed into batches, falls back to single requests
+    for batches with unparsable responses"""
+    batch_summary = GPT('batch_summary')
+    model = batch_summary.model
+    batch_tokens = min(batch_tokens, tokens.prompt_limit(model) -
+                       tokens.count_tokens(batch_summary.system_prompt, model))
+    queued = deque()
+    def prompts():
+        for batch in make_batches(entries, batch_tokens, model):
+            queued.append(batch)
+            yield content_prompt(batch)
+    for response in executor.imap(batch_summary, prompts()):
+        batch = queued.popleft()
+        summaries = parse_content(response, len(batch))
+        if summaries is None:
+            metrics.count('gpt.batch_fallbacks')
+            logging.warning(f"Batch summary response is malformed, "
+                            f"summarizing {len(batch)} entries one by one")
+            yield from summarize_stream(batch)
+        else:
+            yield from (change_content(entrie, content)
+                        for entrie, content in zip(batch, summaries))
+
 def make_topics(entries: list[FeedEntrie], max_attempts: int = 2, 
                 max_cluster_size: int = 6) -> dict[str, list[FeedEntrie]]:
     """Detects topics from entries content and clusterie entries by topics"""
     topics = GPT('cluster', model='gpt-4')
+    def is_valid(response: str) -> bool:
+        try:
+            parse_clusters(response, entries, max_cluster_size)
+            return True
+        except (json.JSONDecodeError, IndexError):
+            return False
     clusters = {}
     for i in range(max_attempts):
-        clusters_response = topics.request(content_prompt(entries))
+        clusters_response = topics.request(content_prompt(entries), validate=is_valid)
         logging.debug(f"Cluters reponse:\n{clusters_response}")
         try:
-            clusters_with_ids = json.loads(clusters_response)
-            clusters = {}
-            for topic, entries_ids in clusters_with_ids.items():
-                if len(entries_ids) > max_cluster_size:
-                    raise IndexError(f"Cluster '{topic}' size is too big ({len(entries_ids)})")
-                logging.info(f"Topic '{topic}' was detected for {len(entries_ids)} messages")
-                clusters[topic] = [entries[idx - 1] for idx in entries_ids]
+            clusters = parse_clusters(clusters_response, entries, max_cluster_size)
+            for topic, cluster_entries in clusters.items():
+                logging.info(f"Topic '{topic}' was detected for {len(cluster_entries)} messages")
             break
         except json.JSONDecodeError:
             logging.warning("Clustering ressponse led to incorrect output (non-json)")
+            metrics.count('gpt.cluster_retries')
         except IndexError:
             logging.warning("Clustering ressponse led to incorrect output (wrong index)")
+            metrics.count('gpt.cluster_retries')
         if i < max_attempts - 1:
             logging.info(f"Trying again ({i+1}/{max_attempts})")
         else:
@@ -112,28 +391,105 @@ def make_topics(entries: list[FeedEntrie], max_attempts: int = 2,
             clusters = {}
     return clusters
 
+def parse_clusters(response: str, entries: list[FeedEntrie],
+                   max_cluster_size: int) -> dict[str, list[FeedEntrie]]:
+    """Parses clustering response of topics with entries numbers, raises JSONDecodeError
+    if it is not JSON and IndexError if numbers are wrong or a cluster is too big"""
+    clusters = {}
+    for topic, entries_ids in json.loads(response).items():
+        if len(entries_ids) > max_cluster_size:
+            raise IndexError(f"Cluster '{topic}' size is too big ({len(entries_ids)})")
+        if not all(isinstance(idx, int) and 0 < idx <= len(entries) for idx in entries_ids):
+            raise IndexError(f"Cluster '{topic}' has wrong message numbers")
+        clusters[topic] = [entries[idx - 1] for idx in entries_ids]
+    return clusters
+
+def make_local_topics(entries: list[FeedEntrie], max_cluster_size: int = 6,
+                      threshold: float = cluster.SIMILARITY_THRESHOLD) -> dict[str, list[FeedEntrie]]:
+    """Clusterizes entries locally by content similarity and asks GPT only to name topics"""
+    groups = [[entries[idx] for idx in rows] for rows in
+              cluster.cluster_texts([entrie.content for entrie in entries],
+                                    max_cluster_size, threshold)]
+    names = executor.map(GPT('topic'), [content_prompt(group) for group in groups])
+    clusters = {}
+    for name, group in zip(names, groups):
+        topic, number = topic_name(name), 1
+        while topic in clusters:
+            number += 1
+            topic = f"{topic_name(name)} ({number})"
+        logging.info(f"Topic '{topic}' was detected for {len(group)} messages")
+        clusters[topic] = group
+    return clusters
+
+def topic_name(response: str) -> str:
+    """Cleans a topic name up from quotes, markup and trailing dot"""
+    lines = response.strip().splitlines() or ["Other news"]
+    return lines[0].strip(' #*"\'.') or "Other news"
+
 def make_topic_summaries(clusters: dict[str, list[FeedEntrie]]) -> list[str]:
     """Writes a summary for each topic"""
     single_summary = GPT('single_summary')
     logging.info(f'Running {len(clusters)} summary tasks')
-    return {topic: single_summary.request(content_prompt(entries))
-            for topic, entries in clusters.items()}
+    summaries = executor.map(single_summary, [content_prompt(entries)
+                                              for entries in clusters.values()])
+    return dict(zip(clusters.keys(), summaries))
 
 def make_highlights(digest: str) -> str:
     """Writes highlights block for a digest"""
     highlights = GPT('highlights', model='gpt-4')
     return highlights.request(digest)
 
-def fix_links(digest: str) -> str:
-    """Fixes meshed up links to sources"""
+def fix_links(lists: dict[str, str]) -> dict[str, str]:
+    """Fixes meshed up links to sources in numbered lists of every topic"""
     fixer = GPT('links', model='gpt-4')
-    return fixer.request(digest)
-
-def translate(digest: str, split_pattern: str = '\n\n## ') -> str:
-    """Translates digest topic by topic"""
-    translator = GPT('translate', model='gpt-4')
-    translated_blocks = []
-    blocks = digest.split(split_pattern)
-    for block in blocks:
-        translated_blocks.append(translator.request(block))
-    return split_pattern.join(translated_blocks)
+    return dict(zip(lists.keys(), executor.map(fixer, lists.values())))
+
+class Translator(GPT):
+    """Translates markdown chunks keeping their surrounding whitespace and link targets"""
+    def __init__(self, language: str):
+        super().__init__('translate', model='gpt-4')
+        self.language = language
+        self.system_prompt = self.system_prompt.format(language=language)
+
+    def request(self, user_prompt: str, max_attempts: int = MAX_ATTEMPTS) -> str:
+        """Run request for the chunk without its leading and trailing whitespace"""
+        text = user_prompt.strip()
+        if not text:
+            return user_prompt
+        start = user_prompt.index(text)
+        translation = restore_links(text, super().request(text, max_attempts).strip())
+        return user_prompt[:start] + translation + user_prompt[start + len(text):]
+
+def restore_links(original: str, translation: str) -> str:
+    """Puts original link targets back into translation in case GPT has changed them"""
+    targets = LINK_TARGET.findall(original)
+    translated_targets = LINK_TARGET.findall(translation)
+    if targets == translated_targets:
+        return translation
+    if len(targets) != len(translated_targets):
+        logging.warning(f"Translation has {len(translated_targets)} links "
+                        f"instead of {len(targets)}")
+        return translation
+    targets = iter(targets)
+    return LINK_TARGET.sub(lambda match: f"]({next(targets)})", translation)
+
+def translate_texts(texts: dict[str, list[str]],
+                    chunk_tokens: int = TRANSLATE_CHUNK_TOKENS) -> dict[str, list[str]]:
+    """Translates texts into their languages, texts are split at markdown boundaries
+    and chunks of all texts and languages are translated concurrently"""
+    translators = {language: Translator(language) for language in texts}
+    model = next(iter(translators.values())).model if translators else 'gpt-4'
+    limit = min(chunk_tokens, tokens.prompt_limit(model) // 2)
+    chunks = {language: [tokens.split_markdown(text, limit, model) for text in language_texts]
+              for language, language_texts in texts.items()}
+    translated = iter(executor.starmap((translators[language], chunk)
+                                       for language, text_chunks in chunks.items()
+                                       for text in text_chunks for chunk in text))
+    return {language: [''.join(next(translated) for _ in text) for text in text_chunks]
+            for language, text_chunks in chunks.items()}
+
+def translate(digest: str, languages: list[str] = ('Russian',),
+              chunk_tokens: int = TRANSLATE_CHUNK_TOKENS) -> dict[str, str]:
+    """Translates digest into every language"""
+    translations = translate_texts({language: [digest] for language in languages}, chunk_tokens)
+    return {language: texts[0] for language, texts in translations.items()}
@@ -11,6 +11,8 @@ PROMPTS_DIR = 'prompts'
 DIGEST_DOMAIN = os.getenv("DIGEST_DOMAIN")
 ENGLISH_DIGEST = '.last-digest-en.md'
 RUSSIAN_DIGEST = '.last-digest-ru.md'
+LANGUAGES = {'en': 'English', 'ru': 'Russian', 'de': 'German', 'fr': 'French', 'es': 'Spanish',
+             'it': 'Italian', 'pt': 'Portuguese', 'zh': 'Chinese', 'ja': 'Japanese'}
 
 def load_prompt(name: str):
     """Loads prompt from text file"""
@@ -40,13 +42,17 @@ def dump_digest(digest: str, russian_digest: bool = False, custom_path: str = No
     with open(path, 'wt', encoding='utf8') as descriptor:
         descriptor.write(digest)
 
+def digest_path(language: str) -> str:
+    """Path of the last digest in the language"""
+    return f'.last-digest-{language}.md'
+
 def url_from_path(filepath: str):
     """Generate valid URL from filepath"""
     lastparts = os.path.abspath(filepath).split("/")[-2:]
     language = lastparts[0]
     date = lastparts[1]
-    if language not in ['ru', 'en']:
-        logging.error('Not a Russian or English language')
+    if language not in LANGUAGES:
+        logging.error(f"Not a digest language: {language}")
         return None
     date = date[:-3]
     return f"https://{DIGEST_DOMAIN}/{language}/{date}"
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Single-pass matching of many keyword regexps against a text"""
+
+import re
+import string
+from collections import deque
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Case-insensitive literals are matched against ASCII-lowercased text, so
+# letters that also match non-ASCII characters (e.g. Kelvin sign) are skipped
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+UNSAFE_FOLDS = 'iks'
+
+class AhoCorasick:
+    """Finds all occurrences of many literal words in one pass over a text"""
+    def __init__(self, words: list[str]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for idx, word in enumerate(words):
+            state = 0
+            for char in word:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.out[state] += (idx,)
+        self._build_links()
+
+    def _build_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] += self.out[self.fail[child]]
+
+    def find(self, text: str) -> set[int]:
+        """Returns indices of all words found in the text"""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+class KeywordMatcher:
+    """Counts distinct keyword regexps found in any of the given texts"""
+    def __init__(self, regexps: list[re.Pattern]):
+        self.regexps = list(regexps)
+        self.plain = set()
+        self.unindexed = []
+        literals = ({}, {})
+        for idx, regexp in enumerate(self.regexps):
+            alternatives, is_plain = required_literals(regexp)
+            if not alternatives:
+                self.unindexed.append(idx)
+                continue
+            folded = bool(regexp.flags & re.IGNORECASE)
+            for literal in alternatives:
+                literals[folded].setdefault(literal, []).append(idx)
+            if is_plain:
+                self.plain.add(idx)
+        self.literals = [list(group.values()) for group in literals]
+        self.automata = [AhoCorasick(list(group.keys())) for group in literals]
+
+    def count(self, *texts: str, limit: int = None) -> int:
+        """Returns number of regexps matching any text, stops early at limit"""
+        matched = set()
+        candidates = []
+        for folded, automaton in enumerate(self.automata):
+            if len(automaton.goto) == 1:
+                continue
+            hits = set()
+            for text in texts:
+                hits.update(automaton.find(text.translate(ASCII_LOWER) if folded else text))
+            for literal_idx in hits:
+                for idx in self.literals[folded][literal_idx]:
+                    if idx in self.plain:
+                        matched.add(idx)
+                    else:
+                        candidates.append(idx)
+        if limit and len(matched) >= limit:
+            return len(matched)
+        candidates.extend(self.unindexed)
+        for idx in candidates:
+            if idx in matched:
+                continue
+            if any(self.regexps[idx].search(text) for text in texts):
+                matched.add(idx)
+                if limit and len(matched) >= limit:
+                    break
+        return len(matched)
+
+def required_literals(regexp: re.Pattern) -> tuple[list[str], bool]:
+    """Returns literals one of which every match must contain and whether
+    a literal occurrence is already a match"""
+    if regexp.flags & re.LOCALE:
+        return None, False
+    try:
+        items = sre_parse.parse(regexp.pattern, regexp.flags)
+    except re.error:
+        return None, False
+    return _sequence_literals(items, bool(regexp.flags & re.IGNORECASE))
+
+def _sequence_literals(items, folded: bool) -> tuple[list[str], bool]:
+    items = _flatten(items)
+    if len(items) == 1 and items[0][0] is sre_parse.BRANCH:
+        alternatives = [_sequence_literals(branch, folded) for branch in items[0][1][1]]
+        if all(literals for literals, _ in alternatives):
+            return ([literal for literals, _ in alternatives for literal in literals],
+                    all(is_plain for _, is_plain in alternatives))
+        return None, False
+    best, run = '', ''
+    is_plain = True
+    for op, av in items:
+        char = chr(av) if op is sre_parse.LITERAL else None
+        if char is not None and folded:
+            char = char.lower() if char.isascii() and char.lower() not in UNSAFE_FOLDS else None
+            is_plain = False
+        if char is not None:
+            run += char
+            continue
+        is_plain = False
+        best = max(best, run, key=len)
+        run = ''
+    best = max(best, run, key=len)
+    return ([best] if best else None), is_plain and bool(best)
+
+def _flatten(items):
+    flat = []
+    for op, av in items:
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            flat.extend(_flatten(av[3]))
+        else:
+            flat.append((op, av))
+    return flat
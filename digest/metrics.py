@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Timing spans and counters of a run with JSON and Prometheus reports"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from digest.cache import CACHE_DIR
+from digest import tokens
+
+logger = logging.getLogger()
+
+REPORTS_DIR = os.path.join(CACHE_DIR, 'reports')
+PROMETHEUS_PREFIX = 'digest'
+
+class Metrics:
+    """Accumulates durations of named spans and values of counters during a run"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets all spans and counters and starts a new run"""
+        with self.lock:
+            self.started = time.time()
+            self.spans = {}
+            self.counters = {}
+
+    @contextmanager
+    def span(self, name: str):
+        """Measures duration of the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """Decorator measuring every call of the function"""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name: str, seconds: float):
+        """Accounts a single span duration"""
+        with self.lock:
+            span = self.spans.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            span['calls'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def count(self, name: str, value: int = 1):
+        """Increases the counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self, command: str) -> dict:
+        """Machine-readable summary of the run"""
+        with self.lock:
+            return {'command': command, 'started': self.started, 'finished': time.time(),
+                    'seconds': time.time() - self.started,
+                    'spans': {name: dict(span) for name, span in sorted(self.spans.items())},
+                    'counters': dict(sorted(self.counters.items())),
+                    'tokens': {stage: dict(totals) for stage, totals in tokens.usage.stages.items()}}
+
+    def dump(self, command: str, path: str = None, prometheus_path: str = None) -> dict:
+        """Writes JSON report, by default into reports directory, and optional Prometheus textfile"""
+        report = self.report(command)
+        if not path:
+            os.makedirs(REPORTS_DIR, exist_ok=True)
+            path = os.path.join(REPORTS_DIR, f"{command}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        write_atomic(path, json.dumps(report, indent=2))
+        logging.info(f"Run report was written to {path}")
+        if prometheus_path:
+            write_atomic(prometheus_path, prometheus_text(report))
+        return report
+
+def prometheus_text(report: dict) -> str:
+    """Formats report in Prometheus text exposition format for the textfile collector"""
+    command = report['command']
+    metrics = {
+        'run_seconds': ("Duration of the last run", [({}, report['seconds'])]),
+        'run_timestamp_seconds': ("Finish time of the last run", [({}, report['finished'])]),
+        'span_seconds': ("Total time spent in the span", [
+            ({'span': name}, span['seconds']) for name, span in report['spans'].items()]),
+        'span_calls': ("Number of span calls", [
+            ({'span': name}, span['calls']) for name, span in report['spans'].items()]),
+        'span_max_seconds': ("Longest span call", [
+            ({'span': name}, span['max_seconds']) for name, span in report['spans'].items()]),
+        'events': ("Counted events", [
+            ({'name': name}, value) for name, value in report['counters'].items()]),
+        'gpt_requests': ("GPT requests by stage", [
+            ({'stage': stage, 'cached': str(cached).lower()},
+             totals['cached' if cached else 'requests'])
+            for stage, totals in report['tokens'].items() for cached in (False, True)]),
+        'gpt_tokens': ("GPT tokens by stage", [
+            ({'stage': stage, 'kind': kind}, totals[f"{kind}_tokens"])
+            for stage, totals in report['tokens'].items() for kind in ('prompt', 'completion')]),
+        'gpt_cost_dollars': ("Estimated GPT cost by stage", [
+            ({'stage': stage}, totals['cost']) for stage, totals in report['tokens'].items()]),
+    }
+    lines = []
+    for name, (description, samples) in metrics.items():
+        name = f"{PROMETHEUS_PREFIX}_{name}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            labels = ','.join(f'{key}="{label}"' for key, label in
+                              {'command': command, **labels}.items())
+            lines.append(f"{name}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
+
+def write_atomic(path: str, text: str):
+    """Writes text via a temporary file, so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf8') as descriptor:
+        descriptor.write(text)
+    os.replace(tmp_path, path)
+
+metrics = Metrics()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Generates, translates, publishes and posts a digest in one process resuming a failed run"""
+import os
+import sys
+import argparse
+import logging
+from datetime import date
+
+from digest.cache import ResponseCache, TranslationMemory, FEED_CACHE_SIZE, FEED_CACHE_TTL
+from digest.checkpoints import RunDirectory, RUNS_DIR, evict_runs
+from digest.feed import DOWNLOAD_WORKERS, DOWNLOAD_BUDGET, PARSE_WORKERS
+from digest.io import ENGLISH_DIGEST, LANGUAGES
+from digest.metrics import metrics, write_atomic
+from digest.seen import SeenStore, RETENTION_DAYS
+from digest.telegram import TelegramBot, SentStore, CHANNELS, deliver, prepare_digest, \
+                            split_message
+from digest import generate, gpt, server, tokens, translate
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', datefmt='%d.%m.%Y %H:%M:%S')
+
+MARKDOWN_DIR = 'markdown'
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("digest.run")
+    parser.add_argument('--run-dir', required=False,
+                        dest='run_dir', help="directory of stage checkpoints, "
+                                             f"by default {RUNS_DIR}/<date>")
+    parser.add_argument('--restart', action='store_true',
+                        dest='restart', help="drop checkpoints and run all stages again")
+    parser.add_argument('--summaries', action='store_true',
+                        dest='summaries', help="add topics summaries")
+    parser.add_argument('--highlights', action='store_true',
+                        dest='highlights', help="add daily highlights")
+    parser.add_argument('--fix-links', action='store_true',
+                        dest='fix_links', help="fix meshed up links")
+    parser.add_argument('--clustering', choices=generate.CLUSTERING, default='gpt',
+                        dest='clustering', help="group entries into topics by a single gpt-4 "
+                                                "request or locally, asking GPT only to name them")
+    parser.add_argument('--batch-tokens', type=int, default=0,
+                        dest='batch_tokens', help="summarize several entries per request "
+                                                  "within this tokens budget")
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                        dest='workers', help="number of concurrent feed downloads")
+    parser.add_argument('--budget', type=float, default=DOWNLOAD_BUDGET,
+                        dest='budget', help="time limit for downloading all feeds, seconds")
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS,
+                        dest='parse_workers', help="number of processes parsing feeds, "
+                                                   "0 parses them in download threads")
+    parser.add_argument('--gpt-workers', type=int, default=gpt.GPT_WORKERS,
+                        dest='gpt_workers', help="number of concurrent GPT requests")
+    parser.add_argument('--tpm', type=int, default=gpt.TOKENS_PER_MINUTE,
+                        dest='tpm', help="GPT tokens per minute limit")
+    parser.add_argument('--rpm', type=int, default=gpt.REQUESTS_PER_MINUTE,
+                        dest='rpm', help="GPT requests per minute limit")
+    parser.add_argument('--model-policy', choices=gpt.ROUTING_POLICIES, default='quality',
+                        dest='policy', help="pick GPT models by stage preference, "
+                                            "lower cost or lower latency")
+    parser.add_argument('--no-cache', action='store_false',
+                        dest='use_cache', help="do not use feeds and responses caches")
+    parser.add_argument('--feed-cache-size', type=int, default=FEED_CACHE_SIZE,
+                        dest='feed_cache_size', help="maximal number of sources in feeds cache")
+    parser.add_argument('--feed-cache-ttl', type=float, default=FEED_CACHE_TTL / (24 * 60 * 60),
+                        dest='feed_cache_ttl', help="days to keep feeds in cache")
+    parser.add_argument('--all-entries', action='store_false',
+                        dest='only_new', help="process entries seen by previous runs too")
+    parser.add_argument('--retention', type=int, default=RETENTION_DAYS,
+                        dest='retention', help="days to remember seen entries, "
+                                               "older entries are skipped")
+    parser.add_argument('--languages', nargs='*', choices=sorted(LANGUAGES), default=['ru'],
+                        metavar='LANGUAGE',
+                        dest='languages', help="languages to translate digest into")
+    parser.add_argument('--chunk-tokens', type=int, default=gpt.TRANSLATE_CHUNK_TOKENS,
+                        dest='chunk_tokens', help="maximal size of a translated chunk in tokens")
+    parser.add_argument('--no-memory', action='store_false',
+                        dest='use_memory', help="do not reuse translations of known segments")
+    parser.add_argument('--root', default=MARKDOWN_DIR,
+                        dest='root', help="directory to publish digests into")
+    parser.add_argument('--send', nargs=2, action='append', default=[],
+                        metavar=('LANGUAGE', 'CHANNEL'), dest='send',
+                        help=f"post digest in the language to the channel: {', '.join(CHANNELS)} "
+                             f"or chat id, may be repeated")
+    parser.add_argument('--only-highlights', action='store_true',
+                        dest='only_highlights', help='post ony highlights and a URL')
+    parser.add_argument('--resend', action='store_false',
+                        dest='use_sent', help='post messages even if they were already sent')
+    parser.add_argument('--report', required=False,
+                        dest='report', help="path of JSON run report, "
+                                            "by default it is kept in .cache/reports")
+    parser.add_argument('--prometheus', required=False,
+                        dest='prometheus', help="path of Prometheus textfile with run metrics")
+    return parser.parse_args()
+
+def translate_digest(digest: str, languages: list[str], run: RunDirectory,
+                     chunk_tokens: int, use_memory: bool) -> dict[str, str]:
+    """Translates digest into languages without checkpoints in the run"""
+    digests = {'en': digest}
+    digests.update({language: run.load(f"digest-{language}.md") for language in languages
+                    if language != 'en' and run.has(f"digest-{language}.md")})
+    missing = [language for language in languages if language not in digests]
+    if missing:
+        memory = TranslationMemory() if use_memory else None
+        for language, translation in translate.translate(digest, missing, None, chunk_tokens,
+                                                         memory).items():
+            run.save(f"digest-{language}.md", translation)
+            digests[language] = translation
+        if memory:
+            memory.evict()
+            memory.close()
+    return digests
+
+def publish(digests: dict[str, str], root: str, day: date) -> dict[str, str]:
+    """Writes digests into the markdown root and prerenders their pages"""
+    paths = {}
+    for language, digest in digests.items():
+        paths[language] = os.path.join(root, language, day.strftime(f"{server.DATE_FORMAT}.md"))
+        write_atomic(paths[language], digest)
+    server.prerender(root)
+    return paths
+
+def post(paths: dict[str, str], targets: list[tuple[str, str]], run: RunDirectory,
+         only_highlights: bool, use_sent: bool) -> bool:
+    """Posts published digests to channels and saves ids of the posted messages"""
+    if run.has('posts.json'):
+        logging.info("Digests were already posted")
+        return True
+    digests = []
+    for language, channel in targets:
+        chat_id = CHANNELS.get(channel, channel)
+        digest = prepare_digest(paths[language], only_highlights) if language in paths else None
+        if not chat_id:
+            logging.error(f"Chat of {channel} channel is not configured")
+        elif digest:
+            digests.append((chat_id, digest))
+    bot = TelegramBot()
+    sent = SentStore() if use_sent else None
+    with metrics.span('telegram.deliver'):
+        delivered = deliver(digests, bot, sent)
+    bot.close()
+    if delivered and sent:
+        posts = {}
+        for chat_id, digest in digests:
+            posts.setdefault(chat_id, []).extend(sent.message_id(chat_id, digest, index)
+                                                 for index in range(len(split_message(digest))))
+        run.save('posts.json', posts)
+    if sent:
+        sent.close()
+    return delivered
+
+def run_digest(run: RunDirectory, args, day: date) -> bool:
+    """Runs all stages skipping the ones with checkpoints"""
+    seen = SeenStore(retention_days=args.retention) if args.only_new else None
+    with metrics.span('run.generate'):
+        digest = generate.generate(ENGLISH_DIGEST, args.summaries, args.highlights,
+                                   args.fix_links, args.workers, args.budget, args.use_cache,
+                                   args.batch_tokens, seen, args.clustering,
+                                   args.parse_workers, run, args.feed_cache_size,
+                                   args.feed_cache_ttl * 24 * 60 * 60)
+    if not digest:
+        return True
+    with metrics.span('run.translate'):
+        digests = translate_digest(digest, args.languages, run, args.chunk_tokens,
+                                   args.use_memory)
+    with metrics.span('run.publish'):
+        paths = publish(digests, args.root, day)
+    if not args.send:
+        return True
+    return post(paths, args.send, run, args.only_highlights, args.use_sent)
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    gpt.configure(args.gpt_workers, args.tpm, args.rpm,
+                  cache=ResponseCache() if args.use_cache else None, policy=args.policy)
+    day = date.today()
+    run = RunDirectory(args.run_dir or os.path.join(RUNS_DIR, day.strftime(server.DATE_FORMAT)))
+    if args.restart:
+        run.clear()
+    evict_runs()
+    done = run_digest(run, args, day)
+    tokens.usage.log()
+    if gpt.response_cache:
+        gpt.response_cache.evict()
+    metrics.dump('run', args.report, args.prometheus)
+    if not done:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Persistent store of entries processed by previous runs"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import logging
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from digest.cache import CACHE_DIR
+
+logger = logging.getLogger()
+
+SEEN_PATH = os.path.join(CACHE_DIR, 'seen.sqlite')
+RETENTION_DAYS = 14
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid')
+
+class SeenStore:
+    """Remembers normalized URLs and content hashes of emitted entries"""
+    def __init__(self, path: str = SEEN_PATH, retention_days: int = RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self.pending = {}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS seen (
+                                       key TEXT PRIMARY KEY, url TEXT, title TEXT, seen REAL)""")
+            self.connection.execute("DELETE FROM seen WHERE seen < ? OR key = 'url:'",
+                                    (time.time() - retention_days * 24 * 60 * 60,))
+
+    def is_new(self, url: str, content: str) -> bool:
+        """Checks that neither URL nor content were emitted before"""
+        keys = entrie_keys(url, content)
+        with self.lock:
+            if any(key in self.pending for key in keys):
+                return False
+            row = self.connection.execute(f"SELECT 1 FROM seen WHERE key IN "
+                                          f"({', '.join('?' * len(keys))})", keys).fetchone()
+        return row is None
+
+    def mark(self, url: str, content: str, title: str = None):
+        """Marks entrie as emitted, it is saved on commit"""
+        with self.lock:
+            for key in entrie_keys(url, content):
+                self.pending[key] = (url, title)
+
+    def commit(self):
+        """Saves marked entries"""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?)",
+                                        [(key, url, title, now)
+                                         for key, (url, title) in self.pending.items()])
+            logging.info(f"{sum(key.startswith('content:') for key in self.pending)} "
+                         f"entries were marked as seen")
+            self.pending = {}
+
+    def stats(self) -> tuple:
+        """Returns number of remembered entries and the oldest and newest times"""
+        with self.lock:
+            return self.connection.execute("""SELECT COUNT(*), MIN(seen), MAX(seen)
+                                              FROM seen WHERE key LIKE 'content:%'""").fetchone()
+
+    def recent(self, limit: int = 20) -> list[tuple]:
+        """Returns recently seen entries"""
+        with self.lock:
+            return self.connection.execute("""SELECT DISTINCT url, title, seen FROM seen
+                                              ORDER BY seen DESC LIMIT ?""", (limit,)).fetchall()
+
+    def reset(self, days: float = None):
+        """Forgets all entries or only the ones seen during last days"""
+        since = time.time() - days * 24 * 60 * 60 if days else 0
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM seen WHERE seen >= ?", (since,))
+
+    def close(self):
+        """Closes database connection"""
+        self.connection.close()
+
+def normalize_url(url: str) -> str:
+    """Drops fragment, tracking parameters, case of host and trailing slash"""
+    parts = urlsplit((url or '').strip())
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'),
+                       urlencode(sorted(query)), ''))
+
+def entrie_keys(url: str, content: str) -> tuple[str, ...]:
+    """Keys of entrie by normalized URL and content hash, entries without URL
+    are only known by content"""
+    content_hash = hashlib.sha1(" ".join((content or '').split()).encode('utf8')).hexdigest()
+    normalized = normalize_url(url)
+    if not normalized:
+        return (f"content:{content_hash}",)
+    return f"url:{normalized}", f"content:{content_hash}"
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("digest.seen")
+    parser.add_argument('command', choices=['stats', 'list', 'reset'],
+                        help="show statistics, list recent entries or forget entries")
+    parser.add_argument('--path', required=False, default=SEEN_PATH,
+                        dest='path', help="path of seen entries store")
+    parser.add_argument('--days', type=float, required=False,
+                        dest='days', help="reset only entries seen during last days")
+    return parser.parse_args()
+
+def main():
+    """Entrie point"""
+    args = get_args()
+    store = SeenStore(args.path)
+    if args.command == 'reset':
+        store.reset(args.days)
+    if args.command == 'list':
+        for url, title, seen in store.recent():
+            print(f"{time.ctime(seen)}\t{title}\t{url}")
+    count, oldest, newest = store.stats()
+    print(f"{count} entries seen" +
+          (f" from {time.ctime(oldest)} to {time.ctime(newest)}" if count else ""))
+    store.close()
+
+if __name__ == "__main__":
+    main()
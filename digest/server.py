@@ -4,15 +4,52 @@
 import http.server
 import socketserver
 import os
+import re
+import html
+import gzip
+import json
+import time
+import select
+import sqlite3
+import hashlib
+import argparse
 import logging
-from urllib.parse import unquote
+import threading
+from datetime import datetime
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote, unquote, urlsplit, parse_qs
 import markdown
+from digest.io import LANGUAGES as DIGEST_LANGUAGES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', datefmt='%d.%m.%Y %H:%M:%S')
 
 PORT = 8000
+MARKDOWN_DIR = '/markdown'
+LANGUAGES = list(DIGEST_LANGUAGES)
+CACHE_SIZE = 128
+WORKERS = 32
+KEEP_ALIVE_TIMEOUT = 5
+IDLE_POLL = 0.05
+CACHE_CONTROL = "public, max-age=300"
+DIGEST_DOMAIN = os.getenv("DIGEST_DOMAIN")
+HOST_PATTERN = re.compile(r'^(?=.{1,253}(?::|$))[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+                          r'(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)*(?::\d{1,5})?$')
+MANIFEST = 'manifest.json'
+REFRESH_INTERVAL = 30
+INDEX_PAGE_SIZE = 20
+FEED_SIZE = 20
+DATE_FORMAT = '%d-%m-%Y'
+SEARCH_INDEX = 'search.sqlite'
+SEARCH_RESULTS = 20
 
 HTML_TEMPLATE = """
 <!doctype html>
@@ -38,40 +75,627 @@ HTML_TEMPLATE = """
 </html>
 """
 
+INDEX_TEMPLATE = """<h1>Daily digests</h1>
+<ul>
+{items}
+</ul>
+<p>{pages}</p>
+"""
+
+RSS_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0">
+<channel>
+  <title>Bio Neural News ({language})</title>
+  <link>{base_url}/{language}/</link>
+  <description>GPT-generated biotech news digest.</description>
+  <language>{language}</language>
+{items}
+</channel>
+</rss>
+"""
+
+SEARCH_TEMPLATE = """<form action="/search"><input name="q" value="{query}">
+<input type="submit" value="Search"></form>
+<ol>
+{items}
+</ol>
+<p>{pages}</p>
+"""
+
+SearchResult = namedtuple('SearchResult', ['language', 'source', 'topic', 'snippet'])
+DigestInfo = namedtuple('DigestInfo', ['source', 'date', 'title', 'snippet', 'mtime'])
+
+class Page:
+    """Rendered page with its validators and compressed variants"""
+    def __init__(self, body: bytes, mtime: float, compressed: dict = None):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.mtime = int(mtime)
+        self.variants = {'identity': body}
+        self.variants.update(compressed or {})
+        self.lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        """Returns the body compressed with the encoding, compresses it once"""
+        with self.lock:
+            if encoding not in self.variants:
+                if encoding == 'br':
+                    self.variants[encoding] = brotli.compress(self.body)
+                else:
+                    self.variants[encoding] = gzip.compress(self.body, compresslevel=6, mtime=0)
+            return self.variants[encoding]
+
+class PageCache:
+    """LRU cache of rendered pages keyed by page key and its version"""
+    def __init__(self, max_size: int = CACHE_SIZE):
+        self.max_size = max_size
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version, build) -> Page:
+        """Returns cached page, builds it again if the version was changed"""
+        with self.lock:
+            cached = self.pages.get(key)
+            if cached and cached[0] == version:
+                self.pages.move_to_end(key)
+                return cached[1]
+        page = build()
+        with self.lock:
+            self.pages[key] = (version, page)
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.max_size:
+                self.pages.popitem(last=False)
+        return page
+
+class Archive:
+    """Manifest of all digests per language, rescanned at most every refresh interval"""
+    def __init__(self, root: str = MARKDOWN_DIR, refresh_interval: float = REFRESH_INTERVAL):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self.digests = {language: {} for language in LANGUAGES}
+        self.ordered = {language: [] for language in LANGUAGES}
+        self.versions = {language: 0 for language in LANGUAGES}
+        self.checked = None
+        self.lock = threading.Lock()
+        self._load_manifest()
+
+    def get(self, language: str, source: str) -> DigestInfo:
+        """Returns digest info or None if there is no such digest"""
+        self.refresh()
+        return self.digests[language].get(source)
+
+    def latest(self, language: str, offset: int = 0, size: int = INDEX_PAGE_SIZE) -> list[DigestInfo]:
+        """Returns digests sorted from the newest one"""
+        self.refresh()
+        return self.ordered[language][offset:offset + size]
+
+    def count(self, language: str) -> int:
+        """Returns number of digests"""
+        self.refresh()
+        return len(self.ordered[language])
+
+    def version(self, language: str) -> int:
+        """Returns a number changing on every manifest update"""
+        self.refresh()
+        return self.versions[language]
+
+    def refresh(self, force: bool = False) -> bool:
+        """Parses new and changed digests, returns True if anything was changed"""
+        if not force and self.checked and time.monotonic() - self.checked < self.refresh_interval:
+            return False
+        with self.lock:
+            if not force and self.checked and \
+               time.monotonic() - self.checked < self.refresh_interval:
+                return False
+            changed = False
+            for language in LANGUAGES:
+                changed |= self._refresh_language(language)
+            self.checked = time.monotonic()
+            return changed
+
+    def _refresh_language(self, language: str) -> bool:
+        directory = os.path.join(self.root, language)
+        try:
+            files = {entry.name[:-3]: entry.stat().st_mtime for entry in os.scandir(directory)
+                     if entry.name.endswith('.md')}
+        except OSError:
+            files = {}
+        digests = self.digests[language]
+        changed = False
+        for source in [source for source in digests if source not in files]:
+            del digests[source]
+            changed = True
+        for source, mtime in files.items():
+            if source not in digests or digests[source].mtime != mtime:
+                digests[source] = describe_digest(os.path.join(directory, f"{source}.md"),
+                                                  source, mtime)
+                changed = True
+        if changed:
+            self._reorder(language)
+            logging.info(f"Archive of {language} digests updated: {len(digests)} digests")
+        return changed
+
+    def _reorder(self, language: str):
+        self.ordered[language] = sorted(self.digests[language].values(),
+                                        key=lambda info: (info.date, info.source), reverse=True)
+        self.versions[language] += 1
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+        for language in LANGUAGES:
+            for item in manifest.get(language, []):
+                info = DigestInfo(**item)
+                self.digests[language][info.source] = info
+            self._reorder(language)
+
+    def dump_manifest(self):
+        """Writes the manifest next to digests"""
+        self.refresh(force=True)
+        manifest = {language: [info._asdict() for info in self.ordered[language]]
+                    for language in LANGUAGES}
+        path = os.path.join(self.root, MANIFEST)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=1)
+        os.replace(f"{path}.tmp", path)
+
+class SearchIndex:
+    """Full-text index of digest topics in SQLite FTS5, updated by file mtimes"""
+    def __init__(self, path: str = None, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self.version = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if readonly:
+            self.connection = self._reader()
+            return
+        self.connection = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS documents (
+                                       language TEXT, source TEXT, mtime REAL,
+                                       PRIMARY KEY (language, source))""")
+            self.connection.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS sections USING fts5(
+                                       language UNINDEXED, source UNINDEXED, topic, body,
+                                       tokenize='unicode61 remove_diacritics 2')""")
+
+    def update(self, root: str) -> int:
+        """Indexes new and changed digests, drops removed ones, returns number of changes"""
+        changes = 0
+        with self.lock, self.connection:
+            for language in LANGUAGES:
+                directory = os.path.join(root, language)
+                try:
+                    files = {entry.name[:-3]: entry.stat().st_mtime
+                             for entry in os.scandir(directory) if entry.name.endswith('.md')}
+                except OSError:
+                    files = {}
+                indexed = dict(self.connection.execute(
+                    "SELECT source, mtime FROM documents WHERE language = ?", (language,)))
+                for source in indexed.keys() - files.keys():
+                    self._delete(language, source)
+                    changes += 1
+                for source, mtime in files.items():
+                    if indexed.get(source) == mtime:
+                        continue
+                    self._delete(language, source)
+                    with open(os.path.join(directory, f"{source}.md"), "r", encoding="utf-8") as file:
+                        sections = split_sections(file.read())
+                    self.connection.executemany("INSERT INTO sections VALUES (?, ?, ?, ?)",
+                                                [(language, source, topic, body)
+                                                 for topic, body in sections])
+                    self.connection.execute("INSERT INTO documents VALUES (?, ?, ?)",
+                                            (language, source, mtime))
+                    changes += 1
+        if changes:
+            logging.info(f"Search index updated: {changes} digests")
+        return changes
+
+    def sync(self, source_archive: Archive):
+        """Updates writable index when the archive was changed"""
+        version = tuple(source_archive.version(language) for language in LANGUAGES)
+        if not self.readonly and version != self.version:
+            self.update(source_archive.root)
+            self.version = version
+
+    def search(self, query: str, language: str = None, limit: int = SEARCH_RESULTS,
+               offset: int = 0) -> list[SearchResult]:
+        """Returns the best matching topics with highlighted snippets"""
+        terms = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+        if not terms:
+            return []
+        sql = """SELECT language, source, topic,
+                        snippet(sections, 3, char(2), char(3), '…', 24)
+                 FROM sections WHERE sections MATCH ?"""
+        params = [terms]
+        if language:
+            sql += " AND language = ?"
+            params.append(language)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        try:
+            if self.readonly:
+                rows = self._reader().execute(sql, params).fetchall()
+            else:
+                with self.lock:
+                    rows = self.connection.execute(sql, params).fetchall()
+        except sqlite3.Error as error:
+            logging.warning(f"Search failed: {error}")
+            return []
+        return [SearchResult(*row) for row in rows]
+
+    def _reader(self) -> sqlite3.Connection:
+        """Read-only connection of the current thread, so queries run concurrently"""
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return self.local.connection
+
+    def _delete(self, language: str, source: str):
+        self.connection.execute("DELETE FROM sections WHERE language = ? AND source = ?",
+                                (language, source))
+        self.connection.execute("DELETE FROM documents WHERE language = ? AND source = ?",
+                                (language, source))
+
+page_cache = PageCache()
+archive = None
+search_index = None
+
 class MarkdownRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Renders markdown digests"""
-    def _send_response(self, content, content_type="text/html"):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        """Serves requests of a keep-alive connection until it is idle too long"""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._wait_request():
+            self.handle_one_request()
+
+    def _wait_request(self) -> bool:
+        """Waits for the next request on the connection, an idle connection gives its
+        worker up after the timeout or after a short poll if other connections wait for one"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self.connection.setblocking(False)
+                buffered = self.rfile.peek(1)
+                self.connection.settimeout(self.timeout)
+            except OSError:
+                return False
+            if buffered:
+                return True
+            readable, _, _ = select.select([self.connection], [], [], IDLE_POLL)
+            if readable:
+                return True
+            if self.server.waiting() or time.monotonic() >= deadline:
+                return False
+
+    def _send_page(self, page: Page, content_type="text/html; charset=utf-8"):
+        if self._not_modified(page):
+            self.send_response(304)
+            self._send_cache_headers(page)
+            self.end_headers()
+            return
+        encoding = choose_encoding(self.headers.get('Accept-Encoding', ''))
+        content = page.encoded(encoding)
         self.send_response(200)
         self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if encoding != 'identity':
+            self.send_header("Content-Encoding", encoding)
+        self._send_cache_headers(page)
         self.end_headers()
-        self.wfile.write(content.encode("utf-8"))
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    def _send_cache_headers(self, page: Page):
+        self.send_header("ETag", page.etag)
+        self.send_header("Last-Modified", page.last_modified)
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("Vary", "Accept-Encoding")
+
+    def _not_modified(self, page: Page) -> bool:
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return page.etag in [tag.strip() for tag in if_none_match.split(',')] or \
+                   if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= page.mtime
+            except (TypeError, ValueError):
+                return False
+        return False
 
     def do_GET(self):
-        source = None
-        file_path = None
-        language = None
-        if self.path.startswith("/en/"):
-            language = 'en'
-            source = unquote(self.path[len("/en/"):])
-            file_path = f"/markdown/en/{source}.md"
-        elif self.path.startswith('/ru/'):
-            language = 'ru'
-            source = unquote(self.path[len("/ru/"):])
-            file_path = f"/markdown/ru/{source}.md"
-
-        logging.info(f"File path is: {file_path}")
-        if not file_path or not os.path.exists(file_path):
-            logging.info("Requested file was not fould")
-            self.send_error(404, "File was not found")
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        if parts == ['search']:
+            self._send_search(parse_qs(url.query))
+            return
+        if not parts:
+            self.send_response(302)
+            self.send_header("Location", f"/{LANGUAGES[0]}/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        language = parts[0]
+        if language not in LANGUAGES or len(parts) > 2:
+            self._not_found()
             return
 
-        with open(file_path, "r", encoding="utf-8") as file:
-            md_content = file.read()
-            content = markdown.markdown(md_content)
-            html_content = HTML_TEMPLATE.format(language=language, source=source, content=content)
-            self._send_response(html_content)
+        if len(parts) == 1:
+            try:
+                page = max(int(parse_qs(url.query).get('page', ['1'])[0]), 1)
+            except ValueError:
+                page = 1
+            self._send_page(page_cache.get(('index', language, page), archive.version(language),
+                                           lambda: render_index(language, page)))
+        elif parts[1] == 'feed.xml':
+            if DIGEST_DOMAIN:
+                base_url = f"https://{DIGEST_DOMAIN}"
+                page = page_cache.get(('feed', language), archive.version(language),
+                                      lambda: render_feed(language, base_url))
+            else:
+                # Feed is not cached as the client controls the Host header
+                host = self.headers.get('Host', '').strip().lower()
+                if not HOST_PATTERN.match(host):
+                    logging.info(f"Feed was requested with invalid host: {host[:100]!r}")
+                    self.send_error(400, "Invalid host")
+                    return
+                page = render_feed(language, f"https://{host}")
+            self._send_page(page, content_type="application/rss+xml; charset=utf-8")
+        else:
+            source = parts[1]
+            info = archive.get(language, source)
+            if not info:
+                self._not_found()
+                return
+            file_path = os.path.join(archive.root, language, f"{source}.md")
+            self._send_page(page_cache.get(file_path, info.mtime,
+                                           lambda: load_page(file_path, language, source,
+                                                             info.mtime)))
 
-if __name__ == "__main__":
-    with socketserver.TCPServer(("", PORT), MarkdownRequestHandler) as httpd:
-        print("Serving on port", PORT)
+    def _send_search(self, params: dict):
+        query = params.get('q', [''])[0].strip()
+        language = params.get('lang', [None])[0]
+        try:
+            page = max(int(params.get('page', ['1'])[0]), 1)
+        except ValueError:
+            page = 1
+        if language not in LANGUAGES:
+            language = None
+        search_index.sync(archive)
+        results = search_index.search(query, language, SEARCH_RESULTS + 1,
+                                      (page - 1) * SEARCH_RESULTS) if query else []
+        content = render_search(query, language, page, results)
+        body = HTML_TEMPLATE.format(language=language or LANGUAGES[0], source="search",
+                                    content=content).encode("utf-8")
+        encoding = choose_encoding(self.headers.get('Accept-Encoding', ''))
+        if encoding != 'identity':
+            body = Page(body, time.time()).encoded(encoding)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding != 'identity':
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _not_found(self):
+        logging.info(f"Requested path was not found: {self.path}")
+        self.send_error(404, "File was not found")
+
+    def do_HEAD(self):
+        self.do_GET()
+
+class PooledHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server handling connections on a fixed pool of worker threads"""
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, workers: int = WORKERS):
+        # Pool goes first as a failed bind calls server_close from the base constructor
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.queued = 0
+        self.lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.queued += 1
+        self.pool.submit(self._process_queued, request, client_address)
+
+    def _process_queued(self, request, client_address):
+        with self.lock:
+            self.queued -= 1
+        self.process_request_thread(request, client_address)
+
+    def waiting(self) -> int:
+        """Number of accepted connections waiting for a worker"""
+        return self.queued
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Selects the best supported content encoding accepted by the client"""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in (['br'] if brotli else []) + ['gzip']:
+        if accepted.get(encoding, 0) > 0:
+            return encoding
+    return 'identity'
+
+def load_page(file_path: str, language: str, source: str, mtime: float) -> Page:
+    """Loads prerendered page if it is fresh, renders the digest otherwise"""
+    html_path = f"{file_path[:-3]}.html"
+    gzip_path = f"{html_path}.gz"
+    if is_fresh(html_path, file_path):
+        with open(html_path, "rb") as file:
+            body = file.read()
+    else:
+        body = render_page(file_path, language, source).encode("utf-8")
+    compressed = {}
+    if is_fresh(gzip_path, file_path):
+        with open(gzip_path, "rb") as file:
+            compressed['gzip'] = file.read()
+    return Page(body, mtime, compressed)
+
+def render_index(language: str, page: int) -> Page:
+    """Renders a page of the digests list"""
+    digests = archive.latest(language, (page - 1) * INDEX_PAGE_SIZE)
+    items = "\n".join(f'<li><a href="/{language}/{html.escape(info.source)}">'
+                      f'{html.escape(info.source)}</a> {html.escape(info.title)}'
+                      f'<br>{html.escape(info.snippet)}</li>' for info in digests)
+    pages = []
+    if page > 1:
+        pages.append(f'<a href="/{language}/?page={page - 1}">Newer</a>')
+    if page * INDEX_PAGE_SIZE < archive.count(language):
+        pages.append(f'<a href="/{language}/?page={page + 1}">Older</a>')
+    content = INDEX_TEMPLATE.format(items=items, pages=" ".join(pages))
+    body = HTML_TEMPLATE.format(language=language, source="archive", content=content)
+    mtime = max((info.mtime for info in digests), default=0)
+    return Page(body.encode("utf-8"), mtime)
+
+def render_feed(language: str, base_url: str) -> Page:
+    """Renders RSS feed of the latest digests"""
+    digests = archive.latest(language, size=FEED_SIZE)
+    base_url = html.escape(base_url)
+    items = "\n".join(f"""  <item>
+    <title>{html.escape(info.title)}: {html.escape(info.source)}</title>
+    <link>{base_url}/{language}/{html.escape(info.source)}</link>
+    <guid>{base_url}/{language}/{html.escape(info.source)}</guid>
+    <pubDate>{formatdate(info.date, usegmt=True)}</pubDate>
+    <description>{html.escape(info.snippet)}</description>
+  </item>""" for info in digests)
+    body = RSS_TEMPLATE.format(language=language, base_url=base_url, items=items)
+    mtime = max((info.mtime for info in digests), default=0)
+    return Page(body.encode("utf-8"), mtime)
+
+def render_search(query: str, language: str, page: int, results: list[SearchResult]) -> str:
+    """Renders search form and results"""
+    items = "\n".join(f'<li><a href="/{result.language}/{html.escape(result.source)}">'
+                      f'{html.escape(result.source)}</a> ({result.language}) '
+                      f'{f"<b>{html.escape(result.topic)}</b>" if result.topic else ""}<br>'
+                      f'{html.escape(result.snippet).replace(chr(2), "<b>").replace(chr(3), "</b>")}'
+                      f'</li>' for result in results[:SEARCH_RESULTS])
+    if query and not results:
+        items = "<li>Nothing was found</li>"
+    link = f"/search?q={html.escape(quote(query))}" + (f"&amp;lang={language}" if language else "")
+    pages = []
+    if page > 1:
+        pages.append(f'<a href="{link}&amp;page={page - 1}">Previous</a>')
+    if len(results) > SEARCH_RESULTS:
+        pages.append(f'<a href="{link}&amp;page={page + 1}">Next</a>')
+    return SEARCH_TEMPLATE.format(query=html.escape(query), items=items, pages=" ".join(pages))
+
+def split_sections(text: str) -> list[tuple[str, str]]:
+    """Splits digest into topics and their text without markdown links"""
+    blocks = re.split(r'^## ', text, flags=re.MULTILINE)
+    sections = [("", blocks[0])] + [block.partition("\n")[::2] for block in blocks[1:]]
+    return [(topic.strip(), re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', body).strip())
+            for topic, body in sections if body.strip()]
+
+def describe_digest(file_path: str, source: str, mtime: float) -> DigestInfo:
+    """Extracts date, title and highlights snippet of a digest"""
+    try:
+        date = datetime.strptime(source, DATE_FORMAT).timestamp()
+    except ValueError:
+        date = mtime
+    with open(file_path, "r", encoding="utf-8") as file:
+        text = file.read()
+    title = next((line[2:].strip() for line in text.splitlines() if line.startswith("# ")),
+                 "Daily digest")
+    blocks = [block.strip() for block in text.split("\n\n") if block.strip()]
+    start = next((i + 1 for i, block in enumerate(blocks) if block.startswith("Daily highlights")),
+                 None)
+    blocks = blocks[start:start + 1] if start is not None else blocks
+    lines = [line for block in blocks for line in block.splitlines() if not line.startswith("#")]
+    snippet = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', " ".join(lines[:3]))
+    return DigestInfo(source, date, title, snippet[:300], mtime)
+
+def render_page(file_path: str, language: str, source: str) -> str:
+    """Renders markdown digest into HTML page"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        content = markdown.markdown(file.read())
+    return HTML_TEMPLATE.format(language=language, source=source, content=content)
+
+def is_fresh(path: str, source_path: str) -> bool:
+    """Checks that the file exists and is not older than its source"""
+    try:
+        return os.stat(path).st_mtime_ns >= os.stat(source_path).st_mtime_ns
+    except OSError:
+        return False
+
+def prerender(root: str = MARKDOWN_DIR):
+    """Writes static HTML and gzipped HTML pages next to every changed digest
+    and updates the manifest"""
+    for language in LANGUAGES:
+        directory = os.path.join(root, language)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            file_path = os.path.join(directory, name)
+            if not name.endswith(".md") or is_fresh(f"{file_path[:-3]}.html.gz", file_path):
+                continue
+            logging.info(f"Prerendering {file_path}")
+            page = render_page(file_path, language, name[:-3]).encode("utf-8")
+            with open(f"{file_path[:-3]}.html", "wb") as file:
+                file.write(page)
+            with gzip.open(f"{file_path[:-3]}.html.gz", "wb", compresslevel=9) as file:
+                file.write(page)
+    Archive(root).dump_manifest()
+    SearchIndex(os.path.join(root, SEARCH_INDEX)).update(root)
+
+def get_args():
+    """Get command line args"""
+    parser = argparse.ArgumentParser("digest.server")
+    parser.add_argument('--port', type=int, default=PORT,
+                        dest='port', help="port to listen")
+    parser.add_argument('--root', default=MARKDOWN_DIR,
+                        dest='root', help="directory with digests by language")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        dest='workers', help="number of threads serving connections")
+    parser.add_argument('--prerender', action='store_true',
+                        dest='prerender', help="write static pages for digests and exit")
+    return parser.parse_args()
+
+def main():
+    """Entrie point"""
+    global archive, search_index
+    args = get_args()
+    if args.prerender:
+        prerender(args.root)
+        return
+    archive = Archive(args.root)
+    index_path = os.path.join(args.root, SEARCH_INDEX)
+    if os.path.exists(index_path):
+        search_index = SearchIndex(index_path, readonly=True)
+    else:
+        logging.warning("Search index was not found, building it in memory")
+        search_index = SearchIndex()
+        search_index.update(args.root)
+    with PooledHTTPServer(("", args.port), MarkdownRequestHandler, args.workers) as httpd:
+        print("Serving on port", args.port)
         httpd.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,51 @@
 # -*- coding: utf-8 -*-
 """Sends generated digest to telegram channel"""
 import argparse
+import hashlib
 import logging
 import os
 import re
+import sys
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 
+from digest.cache import CACHE_DIR
 from digest.io import load_digest, url_from_path
+from digest.metrics import metrics
 
 TELEGRAM_KEY = os.getenv("TELEGRAM_DIGEST_KEY")
+TELEGRAM_API = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 CHANNEL_EN_ID = os.getenv("TELEGRAM_DIGEST_EN_CHANNEL") 
 CHANNEL_RU_ID = os.getenv("TELEGRAM_DIGEST_RU_CHANNEL") 
 CHANNEL_TEST_ID = os.getenv("TELEGRAM_DIGEST_TEST_CHANNEL")
+CHANNELS = {'en': CHANNEL_EN_ID, 'ru': CHANNEL_RU_ID, 'test': CHANNEL_TEST_ID}
+MESSAGE_LIMIT = 4096
+MAX_ATTEMPTS = 5
+REQUEST_TIMEOUT = 10
+CHAT_INTERVAL = 1.0
+MESSAGES_PER_SECOND = 30
+SENT_PATH = os.path.join(CACHE_DIR, 'sent.sqlite')
+SENT_RETENTION_DAYS = 30
+SPLIT_BOUNDARIES = (r'\n+(?=## )', r'\n{2,}', r'\n')
+NUMBER_EMOJIS = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟']
+INLINE_PATTERNS = [
+    r'(?P<link>\[(?P<link_text>[^\[\]\n]*)\]\((?P<url>(?:[^()\s]|\([^()\s]*\))+)\))',
+    r'(?P<bold>\*\*(?P<bold_text>[^*\n]+)\*\*)',
+]
+INLINE_TOKEN = re.compile(r'(?=[\[*])(?:' + '|'.join(INLINE_PATTERNS) + ')')
+BLOCK_PATTERNS = [
+    r'(?P<title>^# [^\n]*(?:\n|$))',
+    r'(?P<header>^## (?P<header_text>[^\n]*))',
+    r'(?P<number>^(?P<digits>10|[1-9])\.(?= ))',
+]
+TOKEN = re.compile(r'(?=[#\d\[*])(?:' + '|'.join(BLOCK_PATTERNS + INLINE_PATTERNS) + ')',
+                   re.MULTILINE)
+SPECIAL_CHARACTERS = '\\_*[]()~`>#+-=|{}.!'
+SEPARATOR = '\0'
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -22,82 +56,261 @@ logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', datefmt=
 def get_args():
     """Get command line args"""
     parser = argparse.ArgumentParser("digest.telegram")
-    parser.add_argument('--input', required=True,
+    parser.add_argument('--input', required=False,
                         dest='input_path', help='input path of digest')
     parser.add_argument("--english", action="store_true",
                         dest="english", help="work with english channel")
     parser.add_argument("--russian", action="store_true",
                         dest="russian", help="work with russian channel")
+    parser.add_argument('--send', nargs=2, action='append', default=[],
+                        metavar=('CHANNEL', 'PATH'), dest='send',
+                        help=f"send digest to the channel: {', '.join(CHANNELS)} or chat id, "
+                             f"may be repeated")
     parser.add_argument('--only-highlights', action='store_true',
                         dest='highlights', help='send ony highlights and a URL')
-    return parser.parse_args()
-
-def escape_md_characters(text):
-    """Converts text to correct MarkdownV2 format"""
-    md_chars = ['_', '*', '[', ']', '(', ')',
-                '~', '`', '>', '#', '+', '-',
-                '=', '|', '{', '}', '.', '!']
-    link_re = re.compile(r'\[([^\[]+)\]\(([^\)]+)\)')
-    result = []
-    words = text.split(' ')
-    for word in words:
-        if link_re.match(word):
-            result.append(word)
-            continue
-        escapeword = ''
-        for char in word:
-            if char in md_chars:
-                escapeword += '\\'
-            escapeword += char
-        result.append(escapeword)
-    return " ".join(result)
-
-def line_numbers_to_emoji(text):
-    """Converts markdown list to nice emojis"""
-    numbers = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣',
-               '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟']
-    for i, emoji in enumerate(numbers, start=1):
-        pattern = f"{i}."
-        if text.startswith(pattern):
-            text = f"{emoji}{text[len(pattern):]}"
+    parser.add_argument('--resend', action='store_false',
+                        dest='use_sent', help='send messages even if they were already sent')
+    parser.add_argument('--report', required=False,
+                        dest='report', help="path of JSON run report, "
+                                            "by default it is kept in .cache/reports")
+    parser.add_argument('--prometheus', required=False,
+                        dest='prometheus', help="path of Prometheus textfile with run metrics")
+    args = parser.parse_args()
+    if not args.input_path and not args.send:
+        parser.error("either --input or --send is required")
+    return args
+
+def render_token(match: re.Match, bold: bool = False) -> str:
+    """Renders a single markdown token as MarkdownV2, **text** inside bold text
+    loses its markers since MarkdownV2 can't nest bold entities"""
+    kind = match.lastgroup
+    if kind == 'title':
+        return ''
+    if kind == 'header':
+        return f"*{render(INLINE_TOKEN, match['header_text'], bold=True)}*"
+    if kind == 'number':
+        return NUMBER_EMOJIS[int(match['digits']) - 1]
+    if kind == 'link':
+        url = match['url'].replace('\\', '\\\\').replace(')', '\\)')
+        return f"[{escape(match['link_text'])}]({url})"
+    return escape(match['bold_text']) if bold else f"*{escape(match['bold_text'])}*"
+
+def render(pattern: re.Pattern, text: str, bold: bool = False) -> str:
+    """Renders tokens of the pattern and escapes plain text between them at once"""
+    text = text.replace(SEPARATOR, '')
+    tokens, gaps = [], []
+    position = 0
+    for match in pattern.finditer(text):
+        gaps.append(text[position:match.start()])
+        tokens.append(render_token(match, bold))
+        position = match.end()
+    gaps.append(text[position:])
+    gaps = escape(SEPARATOR.join(gaps)).split(SEPARATOR)
+    return ''.join(part for pair in zip(gaps, tokens + ['']) for part in pair)
+
+def escape(text: str) -> str:
+    """Escapes all MarkdownV2 special characters"""
+    for char in SPECIAL_CHARACTERS:
+        text = text.replace(char, f"\\{char}")
     return text
 
-def convert_markdown(text):
-    """Change markdown text to telegram API acceptable"""
-    lines = text.split("\n")
-    header = False
-
-    result = []
-    for line in lines:
-        if line.startswith("# "):
-            continue
-        if line.startswith("## "):
-            line = line[3:]
-            header = True
-        line = line_numbers_to_emoji(line)
-        line = escape_md_characters(line)
-        if header:
-            line = f"*{line}*"
-        header = False
-        result.append(line)
-    return "\n".join(result)
-
-def post_message(message_text: str, channel: int):
-    """Posts specifed message in markdown format to the channel"""
-    message_text = convert_markdown(message_text)
-
-    logging.info("Sending telegram message")
-    result = requests.post(f"https://api.telegram.org/bot{TELEGRAM_KEY}/sendMessage",
-                           data = {'chat_id': channel,
-                                   'text': message_text, 
-                                   'parse_mode': 'MarkdownV2'},
-                           timeout=10)
-    result = result.json()
-    if result['ok']:
-        logging.info("Telegram message was sent")
-    else:
-        logging.error(f"Telegram error: {result['description']}")
-    return result
+def escape_text(text: str) -> str:
+    """Escapes special characters keeping links and bold text"""
+    return render(INLINE_TOKEN, text)
+
+def convert_markdown(text: str) -> str:
+    """Change markdown text to telegram API acceptable in a single pass:
+    drops the title, makes headers and **text** bold, keeps links,
+    replaces list numbers up to ten with emojis and escapes the rest"""
+    return render(TOKEN, text)
+
+class TelegramBot:
+    """Bot API client with a shared connection pool, per chat and global rate limits"""
+    def __init__(self, token: str = TELEGRAM_KEY, api_url: str = TELEGRAM_API,
+                 max_attempts: int = MAX_ATTEMPTS, chat_interval: float = CHAT_INTERVAL,
+                 messages_per_second: int = MESSAGES_PER_SECOND):
+        self.url = f"{api_url.rstrip('/')}/bot{token}"
+        self.max_attempts = max_attempts
+        self.chat_interval = chat_interval
+        self.interval = 1 / messages_per_second
+        self.lock = threading.Lock()
+        self.next_moment = 0.0
+        self.chat_moments = {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=len(CHANNELS) * 4)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send_message(self, chat_id: str, text: str) -> dict:
+        """Sends MarkdownV2 message, retries after rate limits and network errors"""
+        result = {'ok': False, 'description': "No attempts were made"}
+        for attempt in range(1, self.max_attempts + 1):
+            self._wait(chat_id)
+            if attempt > 1:
+                metrics.count('telegram.retries')
+            try:
+                with metrics.span('telegram.send_message'):
+                    response = self.session.post(f"{self.url}/sendMessage",
+                                                 data={'chat_id': chat_id, 'text': text,
+                                                       'parse_mode': 'MarkdownV2'},
+                                                 timeout=REQUEST_TIMEOUT)
+                result = response.json()
+            except (requests.RequestException, ValueError) as error:
+                logging.warning(f"Telegram request failed on attempt {attempt}: {error}")
+                result = {'ok': False, 'description': str(error)}
+                self._postpone(chat_id, 2 ** attempt)
+                continue
+            if result.get('ok'):
+                return result
+            retry_after = result.get('parameters', {}).get('retry_after')
+            if retry_after:
+                logging.warning(f"Telegram rate limit for {chat_id}, retrying after {retry_after}s")
+                metrics.count('telegram.rate_limited')
+                self._postpone(chat_id, retry_after)
+            elif response.status_code >= 500:
+                self._postpone(chat_id, 2 ** attempt)
+            else:
+                break
+        logging.error(f"Telegram error: {result.get('description')}")
+        metrics.count('telegram.failed')
+        return result
+
+    def close(self):
+        """Closes connection pool"""
+        self.session.close()
+
+    def _wait(self, chat_id: str):
+        """Sleeps until the next message to the chat is allowed"""
+        with self.lock:
+            now = time.monotonic()
+            moment = max(now, self.next_moment, self.chat_moments.get(chat_id, 0.0))
+            self.next_moment = moment + self.interval
+            self.chat_moments[chat_id] = moment + self.chat_interval
+        time.sleep(moment - now)
+
+    def _postpone(self, chat_id: str, seconds: float):
+        """Schedules next message to the chat not earlier than after seconds"""
+        with self.lock:
+            self.chat_moments[chat_id] = max(self.chat_moments.get(chat_id, 0.0),
+                                             time.monotonic() + seconds)
+
+class SentStore:
+    """Remembers messages sent to every chat, so a re-run does not post them twice"""
+    def __init__(self, path: str = SENT_PATH, retention_days: int = SENT_RETENTION_DAYS):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS sent (
+                                       key TEXT PRIMARY KEY, chat TEXT,
+                                       message_id INTEGER, sent REAL)""")
+            self.connection.execute("DELETE FROM sent WHERE sent < ?",
+                                    (time.time() - retention_days * 24 * 60 * 60,))
+
+    def is_sent(self, chat_id: str, digest: str, index: int) -> bool:
+        """Checks that the part of the digest was sent to the chat"""
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM sent WHERE key = ?",
+                                           (sent_key(chat_id, digest, index),)).fetchone() is not None
+
+    def message_id(self, chat_id: str, digest: str, index: int) -> int:
+        """Telegram id of the sent part of the digest or None"""
+        with self.lock:
+            row = self.connection.execute("SELECT message_id FROM sent WHERE key = ?",
+                                          (sent_key(chat_id, digest, index),)).fetchone()
+        return row[0] if row else None
+
+    def mark(self, chat_id: str, digest: str, index: int, message_id: int):
+        """Saves the part of the digest as sent to the chat"""
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO sent VALUES (?, ?, ?, ?)",
+                                    (sent_key(chat_id, digest, index), chat_id,
+                                     message_id, time.time()))
+
+    def close(self):
+        """Closes database connection"""
+        self.connection.close()
+
+def sent_key(chat_id: str, digest: str, index: int) -> str:
+    """Address of a digest part in the chat"""
+    return f"{chat_id}:{hashlib.sha256(digest.encode('utf8')).hexdigest()}:{index}"
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT,
+                  boundaries: tuple = SPLIT_BOUNDARIES) -> list[str]:
+    """Converts markdown to telegram messages of at most limit characters
+    split at sections, paragraphs and lines"""
+    message = convert_markdown(text.strip())
+    if len(message) <= limit:
+        return [message] if message.strip() else []
+    if not boundaries:
+        return split_line(message, limit)
+    parts = re.split(f"({boundaries[0]})", text)
+    pieces = []
+    for i in range(0, len(parts), 2):
+        if pieces and re.fullmatch(r'#{1,6} [^\n]*\n*', pieces[-1]):
+            pieces[-1] += ''.join(parts[i:i + 2])
+        else:
+            pieces.append(''.join(parts[i:i + 2]))
+    messages = []
+    chunk = ''
+    for piece in pieces:
+        if chunk and len(convert_markdown((chunk + piece).strip())) > limit:
+            messages.extend(split_message(chunk, limit, boundaries[1:]))
+            chunk = ''
+        chunk += piece
+    if chunk:
+        messages.extend(split_message(chunk, limit, boundaries[1:]))
+    return messages
+
+def split_line(message: str, limit: int) -> list[str]:
+    """Splits converted line by spaces, never right after an escaping backslash"""
+    messages = []
+    while len(message) > limit:
+        cut = message.rfind(' ', 0, limit)
+        if cut <= 0:
+            cut = limit - 1 if message[limit - 1] == '\\' else limit
+        messages.append(message[:cut])
+        message = message[cut:].lstrip(' ')
+    return messages + [message]
+
+def deliver(digests: list[tuple[str, str]], bot: TelegramBot, sent: SentStore = None) -> bool:
+    """Posts every digest to its chat, chats are served concurrently
+    and messages of a chat are sent in order"""
+    chats = {}
+    for chat_id, digest in digests:
+        chats.setdefault(chat_id, []).append(digest)
+
+    def post(chat_id: str) -> bool:
+        for digest in chats[chat_id]:
+            for index, message in enumerate(split_message(digest)):
+                if sent and sent.is_sent(chat_id, digest, index):
+                    logging.info(f"Message {index + 1} was already sent to {chat_id}, skipping")
+                    metrics.count('telegram.skipped')
+                    continue
+                logging.info(f"Sending telegram message {index + 1} to {chat_id}")
+                result = bot.send_message(chat_id, message)
+                if not result.get('ok'):
+                    return False
+                logging.info("Telegram message was sent")
+                metrics.count('telegram.sent')
+                if sent:
+                    sent.mark(chat_id, digest, index, result['result']['message_id'])
+        return True
+
+    if not chats:
+        return True
+    with ThreadPoolExecutor(max_workers=len(chats)) as pool:
+        return all(list(pool.map(post, chats)))
+
+def prepare_digest(path: str, only_highlights: bool = False) -> str:
+    """Loads digest and appends its URL, optionally keeping only highlights"""
+    digest = load_digest(custom_path=path)
+    if not digest:
+        return None
+    if only_highlights:
+        digest = digest.split("\n\n")[2]
+    return digest + f"\n\n{url_from_path(path)}"
 
 def main():
     """Entrie point"""
@@ -105,20 +318,30 @@ def main():
     if args.english and args.russian:
         logging.error("Inconsistent options: both english and russian channels selected")
         return
-    channel = CHANNEL_TEST_ID
-    if args.english:
-        channel = CHANNEL_EN_ID
-    elif args.russian:
-        channel = CHANNEL_RU_ID
+    targets = list(args.send)
+    if args.input_path:
+        targets.append(('en' if args.english else 'ru' if args.russian else 'test',
+                        args.input_path))
 
-    digest = load_digest(custom_path=args.input_path)
-    if not digest:
-        return
+    digests = []
+    for channel, path in targets:
+        chat_id = CHANNELS.get(channel, channel)
+        digest = prepare_digest(path, args.highlights)
+        if not chat_id:
+            logging.error(f"Chat of {channel} channel is not configured")
+        elif digest:
+            digests.append((chat_id, digest))
 
-    if args.highlights:
-        digest = digest.split("\n\n")[2]
-    digest += f"\n\n{url_from_path(args.input_path)}"
-    post_message(digest, channel)
+    bot = TelegramBot()
+    sent = SentStore() if args.use_sent else None
+    with metrics.span('telegram.deliver'):
+        delivered = deliver(digests, bot, sent)
+    bot.close()
+    if sent:
+        sent.close()
+    metrics.dump('telegram', args.report, args.prometheus)
+    if not delivered:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
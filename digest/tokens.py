@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Token counting, budgeting and accounting for GPT prompts"""
+
+import os
+import re
+import logging
+import threading
+from functools import lru_cache
+import tiktoken
+
+logger = logging.getLogger()
+
+DEFAULT_ENCODING = 'cl100k_base'
+APPROXIMATE_TOKENS = bool(os.getenv("DIGEST_APPROXIMATE_TOKENS"))
+CONTEXT_LIMITS = {
+    'gpt-3.5-turbo': 4096,
+    'gpt-3.5-turbo-16k': 16384,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+}
+COMPLETION_RESERVE = 1024
+PRICES = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-32k': (0.06, 0.12),
+}
+MARKDOWN_BOUNDARIES = (r'\n+(?=#{1,6} )', r'\n{2,}', r'\n(?=[ \t]*(?:[-*+]|\d+[.)])[ \t])', r'\n')
+
+APPROXIMATE_TOKEN = re.compile(r' ?\w{1,4}|\s+|[^\w\s]')
+
+class ApproximateEncoding:
+    """Local tokenizer of about 4 characters per word token, used when tiktoken
+    could not load its encoding (e.g. without network to download it)"""
+    name = 'approximate'
+
+    def encode(self, text: str) -> list[str]:
+        """Splits text into word pieces, punctuation and whitespace"""
+        return APPROXIMATE_TOKEN.findall(text)
+
+    def decode(self, tokens: list[str]) -> str:
+        """Joins tokens back into text"""
+        return ''.join(tokens)
+
+@lru_cache(maxsize=None)
+def encoder(model: str):
+    """Loads tokenizer of the model once"""
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        logging.warning(f"No tokenizer is known for {model}, using {DEFAULT_ENCODING}")
+        name = DEFAULT_ENCODING
+    return load_encoding(name)
+
+@lru_cache(maxsize=None)
+def load_encoding(name: str):
+    """Loads tiktoken encoding, falls back to approximate counting if it is
+    disabled or could not be downloaded"""
+    if APPROXIMATE_TOKENS:
+        return ApproximateEncoding()
+    try:
+        return tiktoken.get_encoding(name)
+    except (OSError, ValueError) as error:
+        logging.warning(f"Tokenizer {name} could not be loaded, token counts are approximate: "
+                        f"{type(error).__name__}")
+        return ApproximateEncoding()
+
+def count_tokens(text: str, model: str) -> int:
+    """Counts tokens of the text for the model"""
+    return len(encoder(model).encode(text or ''))
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated price of a request in dollars, versioned model names use their base prices"""
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            prompt_price, completion_price = PRICES[name]
+            return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    return 0.0
+
+def prompt_limit(model: str) -> int:
+    """Maximal number of prompt tokens leaving room for the completion"""
+    return CONTEXT_LIMITS.get(model, CONTEXT_LIMITS['gpt-4']) - COMPLETION_RESERVE
+
+def truncate(text: str, max_tokens: int, model: str) -> str:
+    """Cuts the text to fit into max_tokens"""
+    tokens = encoder(model).encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder(model).decode(tokens[:max(max_tokens, 0)])
+
+def split_markdown(text: str, max_tokens: int, model: str,
+                   boundaries: tuple = MARKDOWN_BOUNDARIES) -> list[str]:
+    """Splits markdown into chunks of at most max_tokens at the first boundaries that fit:
+    headings, paragraphs, list items and lines, only single lines are split by tokens.
+    Chunks keep their separators, so joined together they give the text back"""
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    if not boundaries:
+        tokens = encoder(model).encode(text)
+        return [encoder(model).decode(tokens[i:i + max_tokens])
+                for i in range(0, len(tokens), max_tokens)]
+    parts = re.split(f"({boundaries[0]})", text)
+    pieces = [''.join(parts[i:i + 2]) for i in range(0, len(parts), 2)]
+    chunks = []
+    chunk, chunk_size = '', 0
+    for piece in pieces:
+        size = count_tokens(piece, model)
+        if chunk and chunk_size + size > max_tokens:
+            chunks.append(chunk)
+            chunk, chunk_size = '', 0
+        if size > max_tokens:
+            chunks.extend(split_markdown(piece, max_tokens, model, boundaries[1:]))
+            continue
+        chunk += piece
+        chunk_size += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+class TokenUsage:
+    """Accumulates requests and tokens per GPT stage during a run"""
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+            cached: bool = False, model: str = None):
+        """Accounts a single request of the stage"""
+        with self.lock:
+            totals = self.stages.setdefault(stage, {'requests': 0, 'cached': 0,
+                                                    'prompt_tokens': 0, 'completion_tokens': 0,
+                                                    'cost': 0.0})
+            totals['cached' if cached else 'requests'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+            if model:
+                totals['cost'] += cost(model, prompt_tokens, completion_tokens)
+
+    def log(self):
+        """Logs totals of every stage"""
+        for stage, totals in self.stages.items():
+            logging.info(f"Stage {stage}: {totals['requests']} requests, "
+                         f"{totals['cached']} cached, {totals['prompt_tokens']} prompt tokens, "
+                         f"{totals['completion_tokens']} completion tokens, "
+                         f"${totals['cost']:.2f}")
+
+usage = TokenUsage()
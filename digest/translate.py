@@ -1,39 +1,132 @@
 """Digest generation using GPT"""
+import re
 import argparse
 import logging
 
-from digest.io import dump_digest, load_digest, ENGLISH_DIGEST, RUSSIAN_DIGEST
-from digest import gpt
+from digest.cache import ResponseCache, TranslationMemory, normalize_segment
+from digest.io import dump_digest, load_digest, digest_path, ENGLISH_DIGEST, LANGUAGES
+from digest.metrics import metrics
+from digest import gpt, tokens
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', datefmt='%d.%m.%Y %H:%M:%S')
 
+SEGMENT = re.compile(r'(\s*(?:(?:[-*+]|\d+[.)]|#{1,6})\s+)?)(.*?)(\s*)', re.DOTALL)
+
 def get_args():
     """Get command line args"""
     parser = argparse.ArgumentParser("digest.translate")
     parser.add_argument("--input", required=False,
                         dest="input", help="custom path of digest to translate")
     parser.add_argument("--output", required=False,
-                        dest="output", help="custom path to write translated digest")
-    return parser.parse_args()
+                        dest="output", help="custom path to write translated digest, "
+                                            "use {language} placeholder for several languages")
+    parser.add_argument('--languages', nargs='+', choices=sorted(LANGUAGES), default=['ru'],
+                        metavar='LANGUAGE',
+                        dest='languages', help=f"target languages: {', '.join(sorted(LANGUAGES))}")
+    parser.add_argument('--chunk-tokens', type=int, default=gpt.TRANSLATE_CHUNK_TOKENS,
+                        dest='chunk_tokens', help="maximal size of a translated chunk in tokens")
+    parser.add_argument('--gpt-workers', type=int, default=gpt.GPT_WORKERS,
+                        dest='gpt_workers', help="number of concurrent GPT requests")
+    parser.add_argument('--model-policy', choices=gpt.ROUTING_POLICIES, default='quality',
+                        dest='policy', help="pick GPT models by stage preference, "
+                                            "lower cost or lower latency")
+    parser.add_argument('--no-cache', action='store_false',
+                        dest='use_cache', help="do not use responses cache")
+    parser.add_argument('--no-memory', action='store_false',
+                        dest='use_memory', help="do not reuse translations of known segments")
+    parser.add_argument('--report', required=False,
+                        dest='report', help="path of JSON run report, "
+                                            "by default it is kept in .cache/reports")
+    parser.add_argument('--prometheus', required=False,
+                        dest='prometheus', help="path of Prometheus textfile with run metrics")
+    args = parser.parse_args()
+    if args.output and len(args.languages) > 1 and '{language}' not in args.output:
+        parser.error("--output needs {language} placeholder for several languages")
+    return args
+
+def translate(digest: str, languages: list[str], output: str = None,
+              chunk_tokens: int = gpt.TRANSLATE_CHUNK_TOKENS,
+              memory: TranslationMemory = None) -> dict[str, str]:
+    """Translates specified digest into every language, only segments
+    missing in translation memory are sent to GPT"""
+    parts = re.split(r'(\n+)', digest)
+    segments = [(marker, normalize_segment(text), trail)
+                for marker, text, trail in (SEGMENT.fullmatch(part).groups() for part in parts[::2])]
+    texts = [text for _, text, _ in segments if text]
+    known, runs = {}, {}
+    for language in languages:
+        known[language] = memory.get(texts, LANGUAGES[language]) if memory else {}
+        runs[language] = missing_runs(segments, known[language])
+    texts_to_translate = {LANGUAGES[language]: [''.join(parts[2 * start:2 * end + 1])
+                                                for start, end in runs[language]]
+                          for language in languages}
+    with metrics.span('translate.gpt'):
+        translations = gpt.translate_texts(texts_to_translate, chunk_tokens)
+    digests = {}
+    for language in languages:
+        result = list(parts)
+        for idx, (marker, text, trail) in enumerate(segments):
+            if text in known[language]:
+                result[2 * idx] = marker + known[language][text] + trail
+        learned = {}
+        for (start, end), translation in zip(runs[language], translations[LANGUAGES[language]]):
+            result[2 * start:2 * end + 1] = [translation] + [''] * (2 * (end - start))
+            learned.update(align_segments(segments[start:end + 1], translation))
+        if memory:
+            memory.put(learned, LANGUAGES[language])
+            reused = sum(text in known[language] for text in texts)
+            metrics.count('translate.memory.segments', len(texts))
+            metrics.count('translate.memory.reused', reused)
+            metrics.count('translate.memory.learned', len(learned))
+            logging.info(f"Translation memory for {LANGUAGES[language]}: {reused} of {len(texts)} "
+                         f"segments reused ({reused / max(len(texts), 1):.0%}), "
+                         f"{len(learned)} segments learned")
+        digests[language] = ''.join(result)
+        dump_digest(digests[language], custom_path=output.format(language=language)
+                    if output else digest_path(language))
+    return digests
+
+def missing_runs(segments: list[tuple], known: dict[str, str]) -> list[tuple[int, int]]:
+    """Ranges of consecutive segments without known translation"""
+    runs = []
+    for idx, (_, text, _) in enumerate(segments):
+        if not text or text in known:
+            continue
+        if runs and runs[-1][1] == idx - 1:
+            runs[-1] = (runs[-1][0], idx)
+        else:
+            runs.append((idx, idx))
+    return runs
 
-def translate(digest: str, output: str):
-    """Translates specified digest"""
-    ru_digest = gpt.translate(digest)
-    dump_digest(ru_digest, custom_path=output)
-    return ru_digest
+def align_segments(segments: list[tuple], translation: str) -> dict[str, str]:
+    """Pairs source segments with lines of their translation if GPT has kept the lines"""
+    lines = [normalize_segment(SEGMENT.fullmatch(line).group(2))
+             for line in re.split(r'\n+', translation.strip())]
+    if len(lines) != len(segments):
+        return {}
+    return {text: line for (_, text, _), line in zip(segments, lines) if line}
 
 def main():
     """Entrie point"""
     args = get_args()
+    gpt.configure(workers=args.gpt_workers,
+                  cache=ResponseCache() if args.use_cache else None, policy=args.policy)
 
+    memory = TranslationMemory() if args.use_memory else None
     input_path = args.input if args.input else ENGLISH_DIGEST
-    output_path = args.output if args.output else RUSSIAN_DIGEST
 
     digest = load_digest(custom_path=input_path)
     if digest:
-        print(translate(digest, output_path))
+        for translation in translate(digest, args.languages, args.output,
+                                     args.chunk_tokens, memory).values():
+            print(translation)
+    tokens.usage.log()
+    if memory:
+        memory.evict()
+        memory.close()
+    metrics.dump('translate', args.report, args.prometheus)
 
 if __name__ == "__main__":
     main()
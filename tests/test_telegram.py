@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Golden tests of markdown conversion to Telegram MarkdownV2"""
+import os
+import glob
+
+import pytest
+
+from digest.telegram import convert_markdown
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden', 'telegram')
+
+def read(path: str) -> str:
+    """Reads a golden file"""
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+@pytest.mark.parametrize('source', sorted(glob.glob(os.path.join(GOLDEN_DIR, '*.md'))),
+                         ids=lambda path: os.path.basename(path)[:-3])
+def test_convert_markdown(source: str):
+    """Every digest.md converts into its digest.mdv2"""
+    assert convert_markdown(read(source)) == read(source[:-3] + '.mdv2')
+
+def test_header_bold_is_not_nested():
+    """Bold text inside a bold header keeps only the header entity"""
+    assert convert_markdown("## A **b** c") == "*A b c*"